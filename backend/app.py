@@ -1,9 +1,13 @@
 # Flask应用入口
 from flask import Flask
 from flask_cors import CORS
-from config import config
+from config import config, DEFAULT_SECRET_KEY
 from db import db
 from routes import api_bp
+from commands import register_commands
+from compression import compress_response, strip_encoded_etags
+import http_client
+import log_buffer
 
 # 创建应用工厂
 def create_app(config_name='default'):
@@ -12,6 +16,8 @@ def create_app(config_name='default'):
     
     # 加载配置
     app.config.from_object(config[config_name])
+    if app.config['AUTH_REQUIRED'] and app.config['SECRET_KEY'] == DEFAULT_SECRET_KEY:
+        raise RuntimeError('AUTH_REQUIRED needs a SECRET_KEY; the default development key would make tokens forgeable')
     
     # 初始化CORS，允许所有跨域请求
     CORS(app)
@@ -25,6 +31,19 @@ def create_app(config_name='default'):
     # 注册蓝图
     app.register_blueprint(api_bp)
     
+    # 响应压缩；条件请求中带编码后缀的ETag先还原再交给视图比较
+    app.before_request(strip_encoded_etags)
+    app.after_request(compress_response)
+    
+    # 出站HTTP客户端（连接池、超时与重试）
+    http_client.init_app(app)
+    
+    # 日志写后缓冲（LOG_WRITE_BEHIND 开启时）
+    log_buffer.init_app(app)
+    
+    # 注册命令行命令
+    register_commands(app)
+    
     return app
     
 
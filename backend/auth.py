@@ -0,0 +1,98 @@
+# 令牌认证
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+import jwt
+from flask import current_app, request, jsonify, g
+
+# 已验证令牌的进程内缓存：token -> claims，按LRU淘汰
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+def issue_token(user):
+    """为用户签发带过期时间的令牌，返回 (token, 过期时间戳)"""
+    now = int(time.time())
+    expires_at = now + current_app.config['TOKEN_TTL_SECONDS']
+    claims = {
+        'sub': user.phone_number,
+        'role': user.role,
+        'group': user.group,
+        'iat': now,
+        'exp': expires_at
+    }
+    token = jwt.encode(claims, current_app.config['SECRET_KEY'], algorithm=current_app.config['TOKEN_ALGORITHM'])
+    return token, expires_at
+
+def decode_token(token):
+    """验证令牌并返回claims，无效或过期返回None"""
+    now = time.time()
+    with _token_cache_lock:
+        claims = _token_cache.get(token)
+        if claims is not None:
+            if claims['exp'] > now:
+                _token_cache.move_to_end(token)
+                return claims
+            del _token_cache[token]
+
+    try:
+        claims = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=[current_app.config['TOKEN_ALGORITHM']])
+    except jwt.PyJWTError:
+        return None
+
+    with _token_cache_lock:
+        _token_cache[token] = claims
+        while len(_token_cache) > current_app.config['TOKEN_CACHE_SIZE']:
+            _token_cache.popitem(last=False)
+    return claims
+
+def get_current_claims():
+    """读取当前请求 Authorization: Bearer 令牌中的claims，没有或无效时返回None"""
+    if 'auth_claims' not in g:
+        header = request.headers.get('Authorization', '')
+        token = header[7:].strip() if header.startswith('Bearer ') else None
+        g.auth_claims = decode_token(token) if token else None
+    return g.auth_claims
+
+def is_self_or_admin(user_id):
+    """当前令牌是否属于该用户或管理员"""
+    claims = get_current_claims()
+    return bool(claims) and (claims['sub'] == user_id or claims['role'] == 'ADMIN')
+
+def is_admin():
+    """当前请求是否具有管理员权限，未开启强制认证时视为管理员"""
+    if not current_app.config['AUTH_REQUIRED']:
+        return True
+    claims = get_current_claims()
+    return bool(claims) and claims['role'] == 'ADMIN'
+
+def forbid_other_user(user_id):
+    """非管理员只能以令牌中的身份写入数据，代他人提交时返回403响应，否则返回None"""
+    if not current_app.config['AUTH_REQUIRED']:
+        return None
+    claims = get_current_claims()
+    if claims and claims['role'] != 'ADMIN' and user_id != claims['sub']:
+        return jsonify({'error': 'Forbidden'}), 403
+    return None
+
+def auth_required(*roles, self_param=None):
+    """路由认证装饰器
+
+    AUTH_REQUIRED 关闭时仅解析令牌、不拦截请求，便于旧客户端过渡。
+    roles 限定允许的角色；self_param 指定路径参数名时，本人也可访问。
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            claims = get_current_claims()
+            if not current_app.config['AUTH_REQUIRED']:
+                return f(*args, **kwargs)
+            if not claims:
+                return jsonify({'error': 'Authentication required'}), 401
+            if self_param and claims['sub'] == kwargs.get(self_param):
+                return f(*args, **kwargs)
+            if roles and claims['role'] not in roles:
+                return jsonify({'error': 'Forbidden'}), 403
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
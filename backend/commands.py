@@ -0,0 +1,180 @@
+# 命令行维护命令，在backend目录下通过 flask --app app <命令> 运行
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from db import db
+from models import Material, StoredFile, Log, ReadingSession
+from log_details import parse_details, structured_fields
+import reading_sessions
+from counters import reconcile_material_counters
+from search import reindex_material
+from storage import STORAGE_KINDS, collect_garbage, legacy_hashes
+from uploads import purge_stale_sessions
+import epub_index
+import md_render
+import covers
+
+MATERIAL_COUNTER_COLUMNS = ('assigned_count', 'read_count')
+
+@click.command('reconcile-counters')
+@with_appcontext
+def reconcile_counters_command():
+    """按分配表修复材料的 assigned_count / read_count，旧库缺少的计数列先创建"""
+    existing = {column['name'] for column in db.inspect(db.engine).get_columns('materials')}
+    table = Material.__table__
+    with db.engine.begin() as conn:
+        for name in MATERIAL_COUNTER_COLUMNS:
+            if name not in existing:
+                column_type = table.c[name].type.compile(dialect=db.engine.dialect)
+                conn.execute(db.text(f'ALTER TABLE materials ADD COLUMN {name} {column_type} NOT NULL DEFAULT 0'))
+                click.echo(f'added column materials.{name}')
+    drifted = reconcile_material_counters()
+    click.echo(f'Reconciled {drifted} material(s)')
+
+@click.command('reindex-search')
+@with_appcontext
+def reindex_search_command():
+    """重建所有材料的全文检索索引"""
+    material_ids = [row[0] for row in db.session.query(Material.id).order_by(Material.id).all()]
+    for material_id in material_ids:
+        reindex_material(Material.query.get(material_id))
+        # 逐个提交，避免一次性加载全部正文
+        db.session.commit()
+        db.session.expunge_all()
+    click.echo(f'Reindexed {len(material_ids)} material(s)')
+
+@click.command('gc-uploads')
+@click.option('--grace', default=3600, help='只清理超过该秒数未被引用的文件')
+@with_appcontext
+def gc_uploads_command(grace):
+    """删除没有名称引用的上传内容文件及过期的分块上传会话"""
+    purged = purge_stale_sessions(current_app.config['UPLOAD_SESSION_TTL'])
+    click.echo(f'sessions: purged {purged} stale upload(s)')
+    for kind in STORAGE_KINDS:
+        removed, freed = collect_garbage(kind, grace_seconds=grace)
+        click.echo(f'{kind}: removed {removed} blob(s), freed {freed} bytes')
+    # 历史文件没有映射记录，其解析结果与渲染缓存同样需要保留
+    referenced = {row[0] for row in db.session.query(StoredFile.sha256).filter_by(kind='epub').distinct()}
+    referenced |= legacy_hashes('epub')
+    click.echo(f'epub index: removed {epub_index.purge_unreferenced(referenced)} extracted book(s)')
+    referenced = {row[0] for row in db.session.query(StoredFile.sha256).filter_by(kind='md').distinct()}
+    referenced |= legacy_hashes('md')
+    click.echo(f'md render: removed {md_render.purge_unreferenced(referenced)} cached rendering(s)')
+    referenced = {covers.cover_key(row[0]) for row in db.session.query(Material.cover_url).filter(Material.cover_url.isnot(None))}
+    click.echo(f'covers: removed {covers.purge_unreferenced(referenced)} thumbnail set(s)')
+
+@click.command('generate-covers')
+@click.option('--force', is_flag=True, help='重新生成已存在或曾失败的缩略图')
+@with_appcontext
+def generate_covers_command(force):
+    """为所有材料封面同步生成缩略图（用于历史数据）"""
+    config = current_app.config
+    urls = {row[0] for row in db.session.query(Material.cover_url).filter(Material.cover_url.isnot(None))}
+    generated = failed = 0
+    for url in sorted(u for u in urls if covers.is_remote(u)):
+        key = covers.cover_key(url)
+        if not force and covers.status(key) in ('ready', 'failed'):
+            continue
+        try:
+            covers.generate(key, url, config['COVER_THUMB_WIDTHS'], config['COVER_MAX_SOURCE_SIZE'], config['COVER_FETCH_TIMEOUT'])
+            generated += 1
+        except Exception as e:
+            click.echo(f'{url}: {e}')
+            covers.mark_failed(key, e)
+            failed += 1
+    click.echo(f'generated {generated} cover(s), {failed} failed')
+
+LOG_STRUCTURED_COLUMNS = ('ip', 'user_agent', 'content_length', 'ai_query_type')
+
+def _create_missing_indexes(table):
+    """创建模型中已声明、数据库中尚不存在的索引，返回创建的数量"""
+    existing = {index['name'] for index in db.inspect(db.engine).get_indexes(table.name)}
+    created = 0
+    for index in sorted(table.indexes, key=lambda index: index.name):
+        if index.name not in existing:
+            index.create(db.engine)
+            click.echo(f'created index {index.name}')
+            created += 1
+    return created
+
+@click.command('create-log-indexes')
+@with_appcontext
+def create_log_indexes_command():
+    """为已有数据库补建日志表的复合索引（如无过滤列表与导出使用的 (created_at, id)）"""
+    created = _create_missing_indexes(Log.__table__)
+    click.echo(f'created {created} index(es) on logs')
+
+@click.command('backfill-log-fields')
+@click.option('--batch-size', default=1000, help='每批处理的日志条数')
+@with_appcontext
+def backfill_log_fields_command(batch_size):
+    """为历史日志补充结构化列：缺少的列和索引先创建，再从 details 解析回填"""
+    inspector = db.inspect(db.engine)
+    existing = {column['name'] for column in inspector.get_columns('logs')}
+    table = Log.__table__
+    with db.engine.begin() as conn:
+        for name in LOG_STRUCTURED_COLUMNS:
+            if name not in existing:
+                column_type = table.c[name].type.compile(dialect=db.engine.dialect)
+                conn.execute(db.text(f'ALTER TABLE logs ADD COLUMN {name} {column_type} NULL'))
+                click.echo(f'added column logs.{name}')
+    _create_missing_indexes(table)
+
+    # 已回填的行 content_length 不为空，中断后重新运行会从剩余的行继续
+    last_id = 0
+    updated = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Log.id, Log.action, Log.details)
+            .where(Log.id > last_id, Log.content_length.is_(None), Log.details.isnot(None))
+            .order_by(Log.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            content, ip, user_agent = parse_details(row.details)
+            params.append({'id': row.id, **structured_fields(row.action, content, ip, user_agent)})
+        # 按主键批量更新
+        db.session.execute(db.update(Log), params)
+        db.session.commit()
+        last_id = rows[-1].id
+        updated += len(rows)
+        click.echo(f'backfilled {updated} log(s)')
+    click.echo(f'done: backfilled {updated} log(s)')
+
+@click.command('rebuild-reading-sessions')
+@click.option('--batch-size', default=5000, help='每批读取的日志条数')
+@with_appcontext
+def rebuild_reading_sessions_command(batch_size):
+    """清空阅读会话表并按时间顺序重放历史打开/关闭日志重建（建议在无人使用时运行）
+
+    会话表缺少 is_open 列（旧版本创建）时先按当前模型重建表结构，表中数据本就会被重放替换。
+    """
+    table = ReadingSession.__table__
+    inspector = db.inspect(db.engine)
+    if inspector.has_table(table.name) and 'is_open' not in {c['name'] for c in inspector.get_columns(table.name)}:
+        table.drop(db.engine)
+        click.echo(f'dropped outdated table {table.name}')
+    table.create(db.engine, checkfirst=True)
+    written = reading_sessions.rebuild(current_app.config['READING_SESSION_TIMEOUT'], batch_size=batch_size)
+    click.echo(f'rebuilt {written} reading session(s)')
+
+@click.command('expire-reading-sessions')
+@with_appcontext
+def expire_reading_sessions_command():
+    """将超时仍未关闭的阅读会话标记为TIMED_OUT（汇总查询已在读取时计入超时，此命令只整理会话表）"""
+    expired = reading_sessions.expire_stale(current_app.config['READING_SESSION_TIMEOUT'])
+    db.session.commit()
+    click.echo(f'expired {expired} reading session(s)')
+
+def register_commands(app):
+    """注册命令行命令"""
+    app.cli.add_command(reconcile_counters_command)
+    app.cli.add_command(reindex_search_command)
+    app.cli.add_command(gc_uploads_command)
+    app.cli.add_command(generate_covers_command)
+    app.cli.add_command(create_log_indexes_command)
+    app.cli.add_command(backfill_log_fields_command)
+    app.cli.add_command(rebuild_reading_sessions_command)
+    app.cli.add_command(expire_reading_sessions_command)
@@ -0,0 +1,138 @@
+# 响应压缩（gzip / brotli）
+import gzip
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from flask import current_app, g, request
+
+# brotli 为可选依赖，未安装时只使用gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/javascript', 'application/xml', 'application/xhtml+xml',
+    'image/svg+xml', 'text/html', 'text/plain', 'text/markdown', 'text/css', 'text/csv', 'text/xml'
+}
+
+class CompressedCache:
+    """按内容哈希缓存压缩结果的LRU，总大小受字节上限约束"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value, max_bytes):
+        if len(value) > max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+_cache = CompressedCache()
+
+# 压缩响应的强ETag带有编码后缀，如 "<sha256>-gzip"
+_ENCODED_ETAG_RE = re.compile(r'(?<!W/)"([^"]*)-(br|gzip)"')
+
+def _negotiate():
+    """根据 Accept-Encoding 选择编码，优先brotli"""
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+def _compress(data, encoding):
+    config = current_app.config
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BR_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+def strip_encoded_etags():
+    """before_request钩子：去掉 If-None-Match 中强ETag的编码后缀
+
+    视图按原始ETag做条件判断，客户端缓存的压缩实体 "<etag>-gzip" 也能命中304。
+    """
+    header = request.environ.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return
+    encodings = set()
+    def strip(match):
+        encodings.add(match.group(2))
+        return f'"{match.group(1)}"'
+    request.environ['HTTP_IF_NONE_MATCH'] = _ENCODED_ETAG_RE.sub(strip, header)
+    g.etag_encodings = encodings
+
+def _restore_encoded_etag(response):
+    """304响应沿用客户端所缓存实体的ETag，即带编码后缀的形式"""
+    encodings = g.get('etag_encodings')
+    etag, weak = response.get_etag()
+    if not encodings or not etag or weak:
+        return response
+    encoding = _negotiate()
+    if encoding not in encodings:
+        return response
+    response.vary.add('Accept-Encoding')
+    response.set_etag(f'{etag}-{encoding}')
+    return response
+
+def compress_response(response):
+    """after_request钩子：对足够大的文本类响应进行协商压缩"""
+    config = current_app.config
+    if response.status_code == 304:
+        return _restore_encoded_etag(response)
+    if (response.status_code != 200
+            or response.is_streamed and not response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiate()
+    length = response.content_length
+    if encoding is None or (length is not None and length < config['COMPRESS_MIN_SIZE']):
+        return response
+
+    # 静态文件响应：小于上限时读入内存后压缩
+    if response.direct_passthrough:
+        if length is None or length > config['COMPRESS_MAX_FILE_SIZE']:
+            return response
+        response.direct_passthrough = False
+
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    # 较大的响应按内容哈希缓存压缩结果，轮询时不必重复压缩
+    cacheable = len(data) >= config['COMPRESS_CACHE_MIN_SIZE']
+    key = (hashlib.sha1(data).hexdigest(), encoding) if cacheable else None
+    compressed = _cache.get(key) if cacheable else None
+    if compressed is None:
+        compressed = _compress(data, encoding)
+        if cacheable:
+            _cache.put(key, compressed, config['COMPRESS_CACHE_MAX_BYTES'])
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+
+    # 压缩后的实体与原始实体不同，强ETag需区分编码
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    return response
@@ -0,0 +1,37 @@
+# HTTP条件请求（ETag / Last-Modified）
+import hashlib
+from flask import request, Response
+from models import beijing_tz
+
+def make_etag(*parts):
+    """根据若干版本字段计算ETag值"""
+    raw = '|'.join('' if p is None else (p.isoformat() if hasattr(p, 'isoformat') else str(p)) for p in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def _as_aware(dt):
+    """数据库中的时间按北京时间保存且不带时区，补上时区信息"""
+    if dt is None:
+        return None
+    return dt.replace(tzinfo=beijing_tz) if dt.tzinfo is None else dt
+
+def not_modified(etag, last_modified=None):
+    """请求的缓存仍然有效时返回304响应，否则返回None"""
+    last_modified = _as_aware(last_modified)
+    if request.if_none_match:
+        # If-None-Match 优先于 If-Modified-Since
+        if not request.if_none_match.contains_weak(etag):
+            return None
+    elif not (last_modified and request.if_modified_since
+              and last_modified.replace(microsecond=0) <= request.if_modified_since):
+        return None
+
+    response = Response(status=304)
+    return with_validators(response, etag, last_modified)
+
+def with_validators(response, etag, last_modified=None):
+    """为响应设置ETag与Last-Modified，并要求客户端每次重新验证"""
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = _as_aware(last_modified)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
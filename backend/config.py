@@ -5,15 +5,60 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
+# 开发用默认密钥，任何人都可用它伪造令牌，开启强制认证时不允许使用
+DEFAULT_SECRET_KEY = 'dev-secret-key'
+
 class Config:
     """基础配置"""
-    SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key'
+    SECRET_KEY = os.environ.get('SECRET_KEY') or DEFAULT_SECRET_KEY
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
-    # 允许最大上传 16MB
+    # 允许最大上传 16MB（单个请求；更大的文件使用分块上传）
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     
+    # 文件下载：按内容哈希寻址的地址可永久缓存
+    IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+    # 部署在支持 X-Sendfile 的前端服务器后时开启，由前端服务器零拷贝发送文件；
+    # 未开启时，gunicorn 等提供 wsgi.file_wrapper 的服务器也会使用 sendfile
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+    
+    # 分块断点续传上传配置
+    CHUNKED_UPLOAD_MAX_SIZE = int(os.environ.get('CHUNKED_UPLOAD_MAX_SIZE') or 2 * 1024 * 1024 * 1024)
+    CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 建议分块大小，须小于 MAX_CONTENT_LENGTH
+    UPLOAD_SESSION_TTL = 24 * 3600  # 未完成的上传会话保留时间（秒）
+    
+    # 封面缩略图：只生成固定宽度，请求的 ?w= 向上取到最近的宽度
+    COVER_THUMB_WIDTHS = (160, 320, 640)
+    COVER_MAX_SOURCE_SIZE = 20 * 1024 * 1024  # 原图下载大小上限
+    COVER_FETCH_TIMEOUT = 15  # 原图下载超时（秒）
+    
+    # 日志写后缓冲：开启后 POST /api/logs 入队即返回202，由后台线程批量写入
+    LOG_WRITE_BEHIND = os.environ.get('LOG_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+    LOG_BUFFER_MAX_ROWS = 10000  # 缓冲上限
+    LOG_BUFFER_BATCH_SIZE = 500  # 积压达到该条数时立即写入
+    LOG_BUFFER_FLUSH_MS = 200  # 最长写入间隔（毫秒）
+    LOG_BUFFER_FULL_POLICY = os.environ.get('LOG_BUFFER_FULL_POLICY') or 'sync'  # 缓冲已满时：sync 同步写入 / reject 返回503
+    LOG_EXPORT_BATCH_SIZE = 2000  # 日志导出时服务端游标每批读取的行数
+    READING_SESSION_TIMEOUT = 2 * 3600  # 打开材料后超过该秒数仍未关闭的阅读会话记为超时
+    
+    # 出站HTTP请求（图片代理、封面下载等）共享的连接池
+    HTTP_CONNECT_TIMEOUT = 5
+    HTTP_READ_TIMEOUT = 15
+    HTTP_RETRIES = 2  # 仅对GET/HEAD的连接错误及502/503/504重试
+    HTTP_POOL_HOSTS = 32  # 保留连接池的主机数
+    HTTP_POOL_MAXSIZE = 16  # 每个主机保留的keep-alive连接数
+    HTTP_HOST_CONCURRENCY = 16  # 每个主机的最大并发请求数
+    HTTP_HOST_WAIT = 10  # 等待主机并发名额的最长秒数
+    
+    # 图片代理缓存
+    PROXY_FETCH_TIMEOUT = 10
+    PROXY_CACHE_MEMORY_MAX_BYTES = 32 * 1024 * 1024
+    PROXY_CACHE_MEMORY_ITEM_MAX = 256 * 1024  # 只有小于该大小的图片进入内存缓存
+    PROXY_CACHE_DISK_MAX_BYTES = int(os.environ.get('PROXY_CACHE_DISK_MAX_BYTES') or 1024 * 1024 * 1024)
+    PROXY_CACHE_MAX_OBJECT_SIZE = 10 * 1024 * 1024  # 超过该大小的图片不缓存，直接流式转发
+    PROXY_CACHE_DEFAULT_TTL = 24 * 3600  # 上游未给出缓存头时的缓存时间（秒）
+    
     # Volcengine Media Generation Config
     API_KEY = os.environ.get('API_KEY')
     MEDIA_URL = os.environ.get('MEDIA_URL') or 'https://ark.cn-beijing.volces.com/api/v3/images/generations'
@@ -25,6 +70,38 @@ class Config:
     SQLALCHEMY_POOL_RECYCLE = 1800  # 30分钟回收连接，避免MySQL的wait_timeout问题
     SQLALCHEMY_MAX_OVERFLOW = 20
     
+    # 列表接口分页配置（游标分页）
+    DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE') or 50)
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE') or 500)
+    
+    # 令牌认证配置
+    TOKEN_ALGORITHM = 'HS256'
+    TOKEN_TTL_SECONDS = int(os.environ.get('TOKEN_TTL_SECONDS') or 8 * 3600)
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE') or 4096)
+    # 开启后受保护接口必须携带有效令牌；默认关闭以兼容未携带令牌的旧客户端
+    AUTH_REQUIRED = os.environ.get('AUTH_REQUIRED', '').lower() in ('1', 'true', 'yes')
+    
+    # 密码哈希配置：修改 BCRYPT_ROUNDS 后，用户下次登录时会自动按新cost重新哈希
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS') or 12)
+    LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS') or 4)
+    LOGIN_HASH_QUEUE_DEPTH = int(os.environ.get('LOGIN_HASH_QUEUE_DEPTH') or 32)
+    LOGIN_HASH_TIMEOUT = float(os.environ.get('LOGIN_HASH_TIMEOUT') or 10)
+    
+    # 批量导入配置
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1)
+    BULK_INSERT_BATCH_SIZE = int(os.environ.get('BULK_INSERT_BATCH_SIZE') or 500)
+    
+    # 长文本分段的目标字符数
+    SEGMENT_TARGET_CHARS = int(os.environ.get('SEGMENT_TARGET_CHARS') or 4000)
+    
+    # 响应压缩配置（安装 brotli 后优先使用br编码）
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE') or 1024)
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BR_QUALITY = 5
+    COMPRESS_MAX_FILE_SIZE = 8 * 1024 * 1024  # 超过该大小的静态文件不压缩
+    COMPRESS_CACHE_MIN_SIZE = 32 * 1024  # 超过该大小的响应缓存压缩结果
+    COMPRESS_CACHE_MAX_BYTES = int(os.environ.get('COMPRESS_CACHE_MAX_BYTES') or 64 * 1024 * 1024)
+    
     PORT = int(os.environ.get('PORT') or 5000)
     HOST = os.environ.get('HOST') or '127.0.0.1'
 
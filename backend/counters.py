@@ -0,0 +1,61 @@
+# 材料计数缓存（assigned_count / read_count）维护
+from db import db
+from models import Material, MaterialAssignment
+
+def adjust_material_counters(material_id, assigned_delta=0, read_delta=0):
+    """在当前事务中增减材料的分配数与已读数
+
+    使用 col = col + delta 的原子更新，并保留 updated_at，计数变化不算作材料内容修改。
+    """
+    if not assigned_delta and not read_delta:
+        return
+    db.session.query(Material).filter(Material.id == material_id).update({
+        Material.assigned_count: Material.assigned_count + assigned_delta,
+        Material.read_count: Material.read_count + read_delta,
+        Material.updated_at: Material.updated_at
+    }, synchronize_session=False)
+
+def release_user_assignments(user_id):
+    """删除用户的分配记录前调用，按材料扣减计数"""
+    rows = db.session.query(
+        MaterialAssignment.material_id,
+        db.func.count(MaterialAssignment.id),
+        db.func.sum(db.case((MaterialAssignment.read_status == True, 1), else_=0))
+    ).filter(MaterialAssignment.user_id == user_id).group_by(MaterialAssignment.material_id).all()
+    for material_id, assigned, read in rows:
+        adjust_material_counters(material_id, -assigned, -int(read or 0))
+
+def _counter_subqueries():
+    """按分配表计算分配数与已读数的关联子查询"""
+    assigned = db.select(db.func.count(MaterialAssignment.id)) \
+        .where(MaterialAssignment.material_id == Material.id).scalar_subquery()
+    read = db.select(db.func.count(MaterialAssignment.id)) \
+        .where(MaterialAssignment.material_id == Material.id, MaterialAssignment.read_status == True).scalar_subquery()
+    return assigned, read
+
+def refresh_material_counters(material_ids):
+    """在当前事务中按分配表重新计算指定材料的计数，用于批量写入之后"""
+    if not material_ids:
+        return
+    assigned, read = _counter_subqueries()
+    db.session.query(Material).filter(Material.id.in_(material_ids)).update({
+        Material.assigned_count: assigned,
+        Material.read_count: read,
+        Material.updated_at: Material.updated_at
+    }, synchronize_session=False)
+
+def reconcile_material_counters():
+    """按分配表重新计算所有材料的计数，返回修正的材料数"""
+    assigned, read = _counter_subqueries()
+    drifted = db.session.query(Material.id).filter(db.or_(
+        Material.assigned_count != assigned,
+        Material.read_count != read
+    )).count()
+    if drifted:
+        db.session.query(Material).update({
+            Material.assigned_count: assigned,
+            Material.read_count: read,
+            Material.updated_at: Material.updated_at
+        }, synchronize_session=False)
+    db.session.commit()
+    return drifted
@@ -0,0 +1,202 @@
+# 封面缩略图：每个封面原图只下载一次，在后台生成固定宽度的WebP/JPEG版本并存放在本地
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import http_client
+
+# Pillow 未安装时不生成缩略图，请求回退到原图地址
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COVER_DIR = os.path.join(BASE_DIR, 'covers')
+META_FILE = 'meta.json'
+
+# 输出格式：扩展名 -> (Pillow格式, MIME类型, 保存参数)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True})
+}
+
+# 生成失败后的重试间隔：按失败次数指数退避，达到上限后按上限间隔重试
+RETRY_BASE_SECONDS = 5 * 60
+RETRY_MAX_SECONDS = 24 * 3600
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cover-thumb')
+_pending = set()
+_pending_lock = threading.Lock()
+
+def cover_key(url):
+    """封面地址的哈希，地址变化即对应新的缩略图目录"""
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32] if url else None
+
+def is_remote(url):
+    return bool(url) and url.startswith(('http://', 'https://'))
+
+def thumb_url(material_id, url):
+    """材料封面缩略图地址，客户端附加 ?w= 选择宽度；地址随封面变化，可永久缓存"""
+    if not is_remote(url):
+        return None
+    return f'/api/materials/{material_id}/cover/{cover_key(url)}'
+
+def cover_dir(key):
+    return os.path.join(COVER_DIR, key)
+
+def variant_path(key, width, ext):
+    return os.path.join(cover_dir(key), f'{width}.{ext}')
+
+def pick_width(requested, widths):
+    """将请求宽度向上取到已配置的宽度，超过最大值时取最大值"""
+    widths = sorted(widths)
+    if not requested:
+        return widths[-1]
+    for width in widths:
+        if width >= requested:
+            return width
+    return widths[-1]
+
+def _error_path(key):
+    return os.path.join(COVER_DIR, key + '.error')
+
+def _failed_attempts(key):
+    """读取失败标记，返回 (失败次数, 标记时间)，没有标记时返回None"""
+    path = _error_path(key)
+    try:
+        marked_at = os.path.getmtime(path)
+        with open(path, encoding='utf-8') as f:
+            attempts = json.load(f).get('attempts', 1)
+    except FileNotFoundError:
+        return None
+    except (ValueError, AttributeError):
+        attempts = 1  # 旧版本写入的纯文本标记
+    return attempts, marked_at
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+def status(key):
+    """缩略图状态：ready / failed / pending / missing
+
+    失败标记在退避时间内记为failed，之后记为missing，可再次提交生成。
+    """
+    directory = cover_dir(key)
+    if os.path.exists(os.path.join(directory, META_FILE)):
+        return 'ready'
+    failed = _failed_attempts(key)
+    if failed and time.time() < failed[1] + retry_delay(failed[0]):
+        return 'failed'
+    with _pending_lock:
+        if key in _pending:
+            return 'pending'
+    return 'missing'
+
+def schedule(url, widths, max_size, timeout):
+    """提交后台生成任务，已完成、已失败或正在处理时直接返回"""
+    if not is_remote(url) or Image is None:
+        return
+    key = cover_key(url)
+    if status(key) != 'missing':
+        return
+    with _pending_lock:
+        if key in _pending:
+            return
+        _pending.add(key)
+    _executor.submit(_run, key, url, widths, max_size, timeout)
+
+def _run(key, url, widths, max_size, timeout):
+    try:
+        generate(key, url, widths, max_size, timeout)
+    except Exception as e:
+        print(f"Cover thumbnail error ({url}): {e}")
+        mark_failed(key, e)
+    finally:
+        with _pending_lock:
+            _pending.discard(key)
+
+def mark_failed(key, error):
+    """写入失败标记并累计失败次数，标记的修改时间即本次失败时间"""
+    failed = _failed_attempts(key)
+    attempts = failed[0] + 1 if failed else 1
+    os.makedirs(COVER_DIR, exist_ok=True)
+    tmp_path = f'{_error_path(key)}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'error': str(error), 'attempts': attempts}, f)
+    os.replace(tmp_path, _error_path(key))
+
+def _fetch(url, path, max_size, timeout):
+    """流式下载原图到临时文件，超过大小上限时中止"""
+    size = 0
+    with http_client.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=http_client.chunk_size(response)):
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError(f'Cover image exceeds {max_size} bytes')
+                f.write(chunk)
+
+def generate(key, url, widths, max_size, timeout):
+    """下载原图并生成所有宽度与格式的缩略图，完成后原子替换到目标目录"""
+    if Image is None:
+        raise RuntimeError('Pillow is not installed')
+
+    os.makedirs(COVER_DIR, exist_ok=True)
+    work_dir = os.path.join(COVER_DIR, f'.{key}.{uuid.uuid4().hex}.tmp')
+    os.makedirs(work_dir)
+    try:
+        source_path = os.path.join(work_dir, 'source')
+        _fetch(url, source_path, max_size, timeout)
+
+        with Image.open(source_path) as original:
+            # 限制解码尺寸，防止解压炸弹
+            original.draft('RGB', (max(widths) * 2, max(widths) * 2))
+            image = ImageOps.exif_transpose(original).convert('RGB')
+
+        variants = {}
+        for width in sorted(widths):
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                resized = image.resize((width, height), Image.LANCZOS)
+            else:
+                resized = image
+            for ext, (fmt, _, options) in FORMATS.items():
+                resized.save(os.path.join(work_dir, f'{width}.{ext}'), fmt, **options)
+            variants[width] = [resized.width, resized.height]
+        os.remove(source_path)
+
+        with open(os.path.join(work_dir, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'variants': variants}, f)
+
+        target = cover_dir(key)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(work_dir, target)
+
+        if os.path.exists(_error_path(key)):
+            os.remove(_error_path(key))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def purge_unreferenced(referenced):
+    """删除不再被任何材料封面引用的缩略图目录与失败标记，返回删除数量"""
+    if not os.path.isdir(COVER_DIR):
+        return 0
+    removed = 0
+    for name in os.listdir(COVER_DIR):
+        key = name[:-len('.error')] if name.endswith('.error') else name
+        if key in referenced or name.endswith('.tmp'):
+            continue
+        path = os.path.join(COVER_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        removed += 1
+    return removed
@@ -0,0 +1,248 @@
+# EPUB预解析：上传后在后台解析OPF目录与书脊，并把章节与资源解压到按内容哈希划分的目录
+import json
+import os
+import posixpath
+import shutil
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+import storage
+
+EXTRACT_DIR = os.path.join(storage.storage_dir('epub'), 'extracted')
+INDEX_FILE = '.readlab-index.json'
+
+NS = {
+    'container': 'urn:oasis:names:tc:opendocument:xmlns:container',
+    'opf': 'http://www.idpf.org/2007/opf',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'ncx': 'http://www.daisy.org/z3986/2005/ncx/',
+    'xhtml': 'http://www.w3.org/1999/xhtml',
+    'epub': 'http://www.idpf.org/2007/ops'
+}
+
+# 解压后的总大小上限，防止压缩炸弹
+MAX_EXTRACT_BYTES = 512 * 1024 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='epub-index')
+_pending = set()
+_pending_lock = threading.Lock()
+
+class EpubError(Exception):
+    """EPUB结构无效"""
+
+def book_dir(sha256):
+    return os.path.join(EXTRACT_DIR, sha256)
+
+def status(sha256):
+    """索引状态：ready / failed / pending / missing"""
+    directory = book_dir(sha256)
+    if os.path.exists(os.path.join(directory, INDEX_FILE)):
+        return 'ready'
+    if os.path.exists(os.path.join(EXTRACT_DIR, sha256 + '.error')):
+        return 'failed'
+    with _pending_lock:
+        if sha256 in _pending:
+            return 'pending'
+    return 'missing'
+
+def load_index(sha256):
+    with open(os.path.join(book_dir(sha256), INDEX_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+def schedule(sha256, source_path):
+    """提交后台解析任务，已完成或正在处理时直接返回"""
+    if status(sha256) in ('ready', 'pending'):
+        return
+    with _pending_lock:
+        if sha256 in _pending:
+            return
+        _pending.add(sha256)
+    _executor.submit(_run, sha256, source_path)
+
+def _run(sha256, source_path):
+    error_path = os.path.join(EXTRACT_DIR, sha256 + '.error')
+    try:
+        extract(sha256, source_path)
+        if os.path.exists(error_path):
+            os.remove(error_path)
+    except Exception as e:
+        print(f"EPUB extraction error ({sha256}): {e}")
+        os.makedirs(EXTRACT_DIR, exist_ok=True)
+        with open(error_path, 'w', encoding='utf-8') as f:
+            f.write(str(e))
+    finally:
+        with _pending_lock:
+            _pending.discard(sha256)
+
+def _safe_member(name):
+    """规范化压缩包内路径，拒绝绝对路径和越界路径"""
+    normalized = posixpath.normpath(name.replace('\\', '/'))
+    if normalized.startswith(('/', '../')) or normalized in ('.', '..'):
+        return None
+    return normalized
+
+def _resolve_href(base, href):
+    """将相对于某文件的href解析为压缩包内路径，返回 (路径, 锚点)"""
+    # 先分离锚点再解码，文件名中转义的 %23 不会被误当作锚点
+    path, _, fragment = href.partition('#')
+    path, fragment = unquote(path), unquote(fragment)
+    if not path:
+        return base, fragment or None
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base), path)), fragment or None
+
+def _text(element):
+    return ' '.join(''.join(element.itertext()).split()) if element is not None else ''
+
+def _parse_nav(book, nav_path):
+    """解析EPUB3导航文档中的目录"""
+    root = ET.fromstring(book.read(nav_path))
+    toc_nav = None
+    for nav in root.iter(f"{{{NS['xhtml']}}}nav"):
+        if nav.get(f"{{{NS['epub']}}}type") == 'toc':
+            toc_nav = nav
+            break
+    if toc_nav is None:
+        return []
+
+    def walk(ol, level):
+        entries = []
+        for li in ol.findall('xhtml:li', NS):
+            link = li.find('xhtml:a', NS)
+            if link is None:
+                link = li.find('xhtml:span', NS)
+            entry = {'title': _text(link), 'level': level, 'path': None, 'fragment': None}
+            if link is not None and link.get('href'):
+                entry['path'], entry['fragment'] = _resolve_href(nav_path, link.get('href'))
+            entries.append(entry)
+            child = li.find('xhtml:ol', NS)
+            if child is not None:
+                entries.extend(walk(child, level + 1))
+        return entries
+
+    ol = toc_nav.find('xhtml:ol', NS)
+    return walk(ol, 1) if ol is not None else []
+
+def _parse_ncx(book, ncx_path):
+    """解析EPUB2的NCX目录"""
+    root = ET.fromstring(book.read(ncx_path))
+
+    def walk(parent, level):
+        entries = []
+        for point in parent.findall('ncx:navPoint', NS):
+            content = point.find('ncx:content', NS)
+            entry = {'title': _text(point.find('ncx:navLabel/ncx:text', NS)), 'level': level, 'path': None, 'fragment': None}
+            if content is not None and content.get('src'):
+                entry['path'], entry['fragment'] = _resolve_href(ncx_path, content.get('src'))
+            entries.append(entry)
+            entries.extend(walk(point, level + 1))
+        return entries
+
+    nav_map = root.find('ncx:navMap', NS)
+    return walk(nav_map, 1) if nav_map is not None else []
+
+def parse(book):
+    """解析OPF，返回书籍元数据、书脊与目录"""
+    try:
+        container = ET.fromstring(book.read('META-INF/container.xml'))
+        opf_path = container.find('.//container:rootfile', NS).get('full-path')
+        opf = ET.fromstring(book.read(opf_path))
+    except (KeyError, AttributeError, ET.ParseError) as e:
+        raise EpubError(f'Invalid EPUB container: {e}')
+
+    manifest = {}
+    nav_path = None
+    for item in opf.findall('opf:manifest/opf:item', NS):
+        path, _ = _resolve_href(opf_path, item.get('href', ''))
+        manifest[item.get('id')] = {'path': path, 'mediaType': item.get('media-type')}
+        if 'nav' in (item.get('properties') or '').split():
+            nav_path = path
+
+    spine_element = opf.find('opf:spine', NS)
+    if spine_element is None:
+        raise EpubError('Missing spine')
+    spine = []
+    for itemref in spine_element.findall('opf:itemref', NS):
+        item = manifest.get(itemref.get('idref'))
+        if item:
+            spine.append({'index': len(spine), 'path': item['path'], 'mediaType': item['mediaType'],
+                          'linear': itemref.get('linear', 'yes') != 'no'})
+
+    toc = []
+    try:
+        if nav_path:
+            toc = _parse_nav(book, nav_path)
+        elif spine_element.get('toc') in manifest:
+            toc = _parse_ncx(book, manifest[spine_element.get('toc')]['path'])
+    except (KeyError, ET.ParseError) as e:
+        print(f"EPUB toc parse error: {e}")
+
+    # 目录项对应的书脊序号，便于客户端直接按章节请求
+    spine_index = {entry['path']: entry['index'] for entry in spine}
+    for entry in toc:
+        entry['spineIndex'] = spine_index.get(entry['path'])
+
+    metadata = opf.find('opf:metadata', NS)
+    return {
+        'title': _text(metadata.find('dc:title', NS)) if metadata is not None else '',
+        'creator': _text(metadata.find('dc:creator', NS)) if metadata is not None else '',
+        'language': _text(metadata.find('dc:language', NS)) if metadata is not None else '',
+        'opfPath': opf_path,
+        'spine': spine,
+        'toc': toc
+    }
+
+def extract(sha256, source_path):
+    """解析并解压EPUB到 extracted/<sha256>/，先写入临时目录再整体改名"""
+    if os.path.exists(os.path.join(book_dir(sha256), INDEX_FILE)):
+        return
+    os.makedirs(EXTRACT_DIR, exist_ok=True)
+    tmp_dir = os.path.join(EXTRACT_DIR, f'.tmp-{sha256}-{uuid.uuid4().hex}')
+    try:
+        with zipfile.ZipFile(source_path) as book:
+            index = parse(book)
+            total = 0
+            for info in book.infolist():
+                name = _safe_member(info.filename)
+                if not name or info.is_dir():
+                    continue
+                total += info.file_size
+                if total > MAX_EXTRACT_BYTES:
+                    raise EpubError('EPUB too large to extract')
+                target = os.path.join(tmp_dir, *name.split('/'))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with book.open(info) as src, open(target, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, storage.CHUNK_SIZE)
+
+        with open(os.path.join(tmp_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        try:
+            os.rename(tmp_dir, book_dir(sha256))
+        except OSError:
+            # 其他进程已完成同一本书的解析
+            if not os.path.exists(os.path.join(book_dir(sha256), INDEX_FILE)):
+                raise
+    except zipfile.BadZipFile as e:
+        raise EpubError(f'Invalid EPUB archive: {e}')
+    finally:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def purge_unreferenced(referenced):
+    """删除不再被任何上传文件引用的解析结果，返回删除数量"""
+    if not os.path.isdir(EXTRACT_DIR):
+        return 0
+    removed = 0
+    for name in os.listdir(EXTRACT_DIR):
+        sha256 = name[:-len('.error')] if name.endswith('.error') else name
+        if name.startswith('.') or sha256 in referenced:
+            continue
+        path = os.path.join(EXTRACT_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+        removed += 1
+    return removed
@@ -0,0 +1,181 @@
+# 共享的出站HTTP客户端：每个工作进程一个 requests.Session，复用keep-alive连接池
+import os
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+
+# 流式读取的分块大小范围：已知长度时按响应大小取值，未知时取默认值
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_settings = {
+    'connect_timeout': 5,
+    'read_timeout': 15,
+    'retries': 2,
+    'pool_hosts': 32,
+    'pool_maxsize': 16,
+    'host_concurrency': 16,
+    'host_wait': 10
+}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_host_slots = {}
+_host_inflight = {}
+_host_lock = threading.Lock()
+
+class HostBusy(requests.RequestException):
+    """目标主机的并发请求数已达上限"""
+
+class _PoolStats:
+    """连接池与并发指标"""
+
+    def __init__(self):
+        self.counters = metrics.Counters()
+
+    def snapshot(self):
+        data = self.counters.snapshot()
+        with _host_lock:
+            data['inflight'] = {host: count for host, count in _host_inflight.items() if count}
+        pools = {}
+        session = _session if _session_pid == os.getpid() else None
+        if session is not None:
+            for adapter in set(session.adapters.values()):
+                for key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is None:
+                        continue
+                    pools[f'{pool.scheme}://{pool.host}:{pool.port}'] = {
+                        'connections': pool.num_connections,
+                        'requests': pool.num_requests,
+                        # 队列中的None是尚未建立连接的占位
+                        'idle': sum(1 for conn in list(pool.pool.queue) if conn) if pool.pool else 0
+                    }
+        data['pools'] = pools
+        return data
+
+stats = metrics.register('http_client', _PoolStats())
+
+def init_app(app):
+    """从应用配置读取超时、重试与连接池参数"""
+    config = app.config
+    _settings.update({
+        'connect_timeout': config['HTTP_CONNECT_TIMEOUT'],
+        'read_timeout': config['HTTP_READ_TIMEOUT'],
+        'retries': config['HTTP_RETRIES'],
+        'pool_hosts': config['HTTP_POOL_HOSTS'],
+        'pool_maxsize': config['HTTP_POOL_MAXSIZE'],
+        'host_concurrency': config['HTTP_HOST_CONCURRENCY'],
+        'host_wait': config['HTTP_HOST_WAIT']
+    })
+
+def get_session():
+    """获取当前进程的共享Session；fork出的工作进程会重新创建，避免共享套接字"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _create_session()
+                _session_pid = pid
+    return _session
+
+def _create_session():
+    # 只对幂等请求的连接错误和网关类错误重试
+    retry = Retry(
+        total=_settings['retries'],
+        connect=_settings['retries'],
+        read=0,
+        status=_settings['retries'],
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(pool_connections=_settings['pool_hosts'], pool_maxsize=_settings['pool_maxsize'], max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _acquire_host(host):
+    with _host_lock:
+        slots = _host_slots.get(host)
+        if slots is None:
+            slots = _host_slots[host] = threading.BoundedSemaphore(_settings['host_concurrency'])
+    if not slots.acquire(timeout=_settings['host_wait']):
+        stats.counters.incr('host_busy')
+        raise HostBusy(f'Too many concurrent requests to {host}')
+    with _host_lock:
+        _host_inflight[host] = _host_inflight.get(host, 0) + 1
+
+    released = False
+    def release():
+        nonlocal released
+        if released:
+            return
+        released = True
+        with _host_lock:
+            _host_inflight[host] -= 1
+        slots.release()
+    return release
+
+def request(method, url, stream=False, timeout=None, **kwargs):
+    """通过共享Session发送请求
+
+    timeout 缺省为配置的 (连接超时, 读取超时)。stream=True 时主机并发名额保留到响应关闭，
+    调用方应使用 with 语句或显式 close()。
+    """
+    host = urlsplit(url).netloc
+    release = _acquire_host(host)
+    stats.counters.incr('requests')
+    try:
+        response = get_session().request(
+            method, url, stream=stream,
+            timeout=timeout or (_settings['connect_timeout'], _settings['read_timeout']), **kwargs
+        )
+    except Exception:
+        stats.counters.incr('errors')
+        release()
+        raise
+
+    if not stream:
+        release()
+        return response
+
+    close = response.close
+    def close_and_release():
+        try:
+            close()
+        finally:
+            release()
+    response.close = close_and_release
+    return response
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def chunk_size(response):
+    """按响应长度选择流式读取的分块大小，小响应一次读完"""
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit():
+        return min(max(int(length), MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    return DEFAULT_CHUNK_SIZE
+
+def iter_body(response):
+    """流式读取响应体，结束或中断时关闭响应并归还连接
+
+    生成器未开始迭代时 finally 不会执行，调用方仍需在响应结束时调用 response.close()（可重复调用）。
+    """
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size(response)):
+            yield chunk
+    finally:
+        response.close()
@@ -0,0 +1,142 @@
+# 日志写后缓冲：事件先进入进程内有界队列，由后台线程定时或按条数批量写入数据库
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from db import db
+from models import Log
+import metrics
+import reading_sessions
+
+# 缓冲已满时的处理策略
+POLICY_SYNC = 'sync'  # 退回为同步写入
+POLICY_REJECT = 'reject'  # 拒绝并返回503，由客户端稍后重试
+POLICIES = (POLICY_SYNC, POLICY_REJECT)
+
+class BufferFull(Exception):
+    """日志缓冲已满"""
+
+class _BufferStats:
+    """缓冲计数与当前积压"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.counters = metrics.Counters()
+
+    def snapshot(self):
+        data = self.counters.snapshot()
+        data['pending'] = len(self.buffer)
+        return data
+
+class LogBuffer:
+    """有界日志缓冲与后台批量写入线程"""
+
+    def __init__(self, app, max_rows, batch_size, flush_interval, policy):
+        self.app = app
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+
+        self._rows = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._thread_pid = None
+        self.stats = metrics.register('log_buffer', _BufferStats(self))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def submit(self, row):
+        """放入一条日志（Log 列名到值的字典），缓冲已满时抛出 BufferFull"""
+        self._ensure_thread()
+        with self._cond:
+            if self._closed or len(self._rows) >= self.max_rows:
+                self.stats.counters.incr('full')
+                raise BufferFull()
+            self._rows.append(row)
+            self.stats.counters.incr('enqueued')
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify()
+
+    def _ensure_thread(self):
+        """按进程启动写入线程；fork出的工作进程需要各自的线程"""
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._cond:
+            if self._thread_pid == pid:
+                return
+            self._rows.clear()
+            self._thread = threading.Thread(target=self._run, name='log-flusher', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._rows) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+                closed = self._closed
+            if batch:
+                self._flush(batch)
+            elif closed:
+                return
+
+    def _flush(self, batch):
+        """批量插入并更新阅读会话；整批失败时逐条写入，丢弃无法写入的行（如用户已被删除）"""
+        started = time.perf_counter()
+        with self.app.app_context():
+            timeout = self.app.config['READING_SESSION_TIMEOUT']
+            try:
+                db.session.execute(db.insert(Log), batch)
+                reading_sessions.apply_rows(batch, timeout)
+                db.session.commit()
+                self.stats.counters.incr('flushed', len(batch))
+                self.stats.counters.incr('batches')
+            except Exception as e:
+                db.session.rollback()
+                print(f"Log batch flush error: {e}")
+                for row in batch:
+                    try:
+                        db.session.execute(db.insert(Log), [row])
+                        reading_sessions.apply_rows([row], timeout)
+                        db.session.commit()
+                        self.stats.counters.incr('flushed')
+                    except Exception as row_error:
+                        db.session.rollback()
+                        self.stats.counters.incr('dropped')
+                        print(f"Log row dropped ({row.get('action')}, {row.get('user_id')}): {row_error}")
+            finally:
+                db.session.remove()
+        self.stats.counters.incr('flush_ms', int((time.perf_counter() - started) * 1000))
+
+    def close(self, timeout=10):
+        """停止接收并写入全部积压日志"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join(timeout)
+
+def init_app(app):
+    """开启 LOG_WRITE_BEHIND 时创建日志缓冲，进程退出前写入积压日志"""
+    config = app.config
+    if not config['LOG_WRITE_BEHIND']:
+        return None
+    if config['LOG_BUFFER_FULL_POLICY'] not in POLICIES:
+        raise ValueError(f"LOG_BUFFER_FULL_POLICY must be one of {POLICIES}")
+
+    buffer = LogBuffer(
+        app,
+        max_rows=config['LOG_BUFFER_MAX_ROWS'],
+        batch_size=config['LOG_BUFFER_BATCH_SIZE'],
+        flush_interval=config['LOG_BUFFER_FLUSH_MS'] / 1000,
+        policy=config['LOG_BUFFER_FULL_POLICY']
+    )
+    app.extensions['log_buffer'] = buffer
+    atexit.register(buffer.close)
+    return buffer
@@ -0,0 +1,45 @@
+# 日志详情的结构化字段：写入时直接拆出，分析时可在SQL中过滤而无需逐行解析JSON
+import json
+
+# AI相关操作对应的查询类型；其他以 AI_ 开头的操作取后缀小写
+AI_QUERY_TYPES = {
+    'AI_QUERY': 'chat',
+    'AI_SUMMARY': 'summary'
+}
+
+def ai_query_type(action, explicit=None):
+    """推断AI查询类型，非AI操作返回None"""
+    if explicit:
+        return str(explicit)[:32]
+    if action in AI_QUERY_TYPES:
+        return AI_QUERY_TYPES[action]
+    if action and action.startswith('AI_'):
+        return action[3:].lower()[:32] or None
+    return None
+
+def structured_fields(action, content, ip, user_agent, query_type=None):
+    """返回需要写入 Log 的结构化列"""
+    if content is None:
+        content_length = 0
+    elif isinstance(content, str):
+        content_length = len(content)
+    else:
+        content_length = len(json.dumps(content, ensure_ascii=False))
+    return {
+        'ip': ip[:45] if ip else None,
+        'user_agent': user_agent[:512] if user_agent else None,
+        'content_length': content_length,
+        'ai_query_type': ai_query_type(action, query_type)
+    }
+
+def parse_details(details):
+    """解析历史日志的 details 文本，返回 (content, ip, userAgent)；非JSON文本整体视为content"""
+    if not details:
+        return None, None, None
+    try:
+        parsed = json.loads(details)
+    except ValueError:
+        return details, None, None
+    if not isinstance(parsed, dict):
+        return parsed, None, None
+    return parsed.get('content'), parsed.get('ip'), parsed.get('userAgent')
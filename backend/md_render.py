@@ -0,0 +1,111 @@
+# Markdown服务端渲染缓存：按内容哈希缓存清洗后的HTML与章节索引
+import json
+import os
+import re
+import threading
+import uuid
+import bleach
+import markdown
+from markdown.extensions.toc import slugify_unicode
+import storage
+
+RENDER_DIR = os.path.join(storage.storage_dir('md'), 'rendered')
+
+# 渲染规则变化时递增，使旧缓存自然失效
+RENDER_VERSION = 2
+
+ALLOWED_TAGS = [
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'del', 'div', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub', 'sup', 'table', 'tbody',
+    'td', 'tfoot', 'th', 'thead', 'tr', 'ul', 'dl', 'dt', 'dd'
+]
+_ATTRIBUTES = {
+    '*': ['id', 'class'],
+    'a': ['href', 'title'],
+    'img': ['src', 'alt', 'title', 'width', 'height'],
+    'th': ['align'],
+    'td': ['align']
+}
+ALLOWED_PROTOCOLS = ['http', 'https', 'mailto', 'data']
+
+# 内联图片只允许位图类型，SVG等可携带脚本的类型不放行
+DATA_IMAGE_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp')
+_URI_NOISE_RE = re.compile(r'[`\x00-\x20\x7f-\xa0\s]+')
+
+def _allow_attribute(tag, name, value):
+    """属性白名单；data: URI 仅允许出现在 img 的 src 中且必须是位图
+
+    bleach 在属性过滤之后才检查协议，因此 data 仍需列在协议白名单中，由这里按标签收紧。
+    """
+    if name not in _ATTRIBUTES.get(tag, []) and name not in _ATTRIBUTES['*']:
+        return False
+    if name in ('href', 'src'):
+        normalized = _URI_NOISE_RE.sub('', value).lower()
+        if normalized.startswith('data:'):
+            return tag == 'img' and name == 'src' and normalized[len('data:'):].startswith(DATA_IMAGE_TYPES)
+    return True
+
+ALLOWED_ATTRIBUTES = _allow_attribute
+
+_render_lock = threading.Lock()
+
+def _cache_path(sha256):
+    return os.path.join(RENDER_DIR, f'{sha256}.v{RENDER_VERSION}.json')
+
+def _flatten(tokens, result):
+    """将markdown toc扩展的嵌套标题树展开为章节列表"""
+    for token in tokens:
+        result.append({'id': token['id'], 'title': token['name'], 'level': token['level']})
+        _flatten(token['children'], result)
+    return result
+
+def render(text):
+    """渲染Markdown为清洗后的HTML，标题带锚点，返回 (html, 章节列表)"""
+    md = markdown.Markdown(extensions=['extra', 'sane_lists', 'toc'], extension_configs={
+        'toc': {'permalink': False, 'slugify': slugify_unicode}
+    })
+    html = md.convert(text)
+    clean = bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES,
+                         protocols=ALLOWED_PROTOCOLS, strip=True)
+    return clean, _flatten(md.toc_tokens, [])
+
+def get_rendered(sha256, source_path):
+    """读取渲染缓存，未命中时渲染并原子写入磁盘缓存
+
+    缓存按内容哈希命名，文件被替换后名称指向新的哈希，旧缓存不再被使用。
+    """
+    path = _cache_path(sha256)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+
+    with _render_lock:
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+
+        with open(source_path, encoding='utf-8-sig', errors='replace') as f:
+            html, sections = render(f.read())
+        result = {'sha256': sha256, 'html': html, 'sections': sections}
+
+        os.makedirs(RENDER_DIR, exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return result
+
+def purge_unreferenced(referenced):
+    """删除不再被引用或版本过期的渲染缓存，返回删除数量"""
+    if not os.path.isdir(RENDER_DIR):
+        return 0
+    removed = 0
+    suffix = f'.v{RENDER_VERSION}.json'
+    for name in os.listdir(RENDER_DIR):
+        if name.endswith(suffix) and name[:-len(suffix)] in referenced:
+            continue
+        os.remove(os.path.join(RENDER_DIR, name))
+        removed += 1
+    return removed
@@ -0,0 +1,69 @@
+# 进程内运行指标
+import threading
+import time
+from collections import Counter, deque
+
+# 已注册的指标对象，按名称汇总输出
+_registry = {}
+
+def register(name, metric):
+    """注册指标对象，需提供 snapshot() 方法"""
+    _registry[name] = metric
+    return metric
+
+def snapshot_all():
+    """汇总所有已注册指标的快照"""
+    return {name: metric.snapshot() for name, metric in _registry.items()}
+
+class LatencyRecorder:
+    """记录最近一段请求的耗时分布与结果计数"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self._outcomes = Counter()
+
+    def record(self, seconds, outcome='ok'):
+        with self._lock:
+            self._samples.append(seconds)
+            self._outcomes[outcome] += 1
+
+    def time(self):
+        """返回起始时间戳，配合 record(time.perf_counter() - start) 使用"""
+        return time.perf_counter()
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            outcomes = dict(self._outcomes)
+        if not samples:
+            return {'count': sum(outcomes.values()), 'outcomes': outcomes}
+
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 2)
+
+        return {
+            'count': sum(outcomes.values()),
+            'outcomes': outcomes,
+            'window': len(samples),
+            'avgMs': round(sum(samples) / len(samples) * 1000, 2),
+            'p50Ms': percentile(0.5),
+            'p95Ms': percentile(0.95),
+            'p99Ms': percentile(0.99),
+            'maxMs': round(samples[-1] * 1000, 2)
+        }
+
+class Counters:
+    """线程安全的计数器集合"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = Counter()
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._values[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
@@ -1,6 +1,7 @@
 # 数据模型
 from datetime import datetime, timezone, timedelta
 from db import db
+from covers import thumb_url
 
 # 创建北京时间时区对象
 beijing_tz = timezone(timedelta(hours=8))
@@ -24,8 +25,14 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(beijing_tz))
     updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(beijing_tz), onupdate=lambda: datetime.now(beijing_tz))
 
-    def to_dict(self):
-        """将模型转换为字典"""
+    def to_dict(self, assigned_materials_count=None):
+        """将模型转换为字典
+
+        列表接口会通过聚合查询预先算好 assigned_materials_count 并传入，
+        未传入时才回退到加载关系计数。
+        """
+        if assigned_materials_count is None:
+            assigned_materials_count = len(self.assigned_materials)
         return {
             'phone_number': self.phone_number,
             'name': self.name,
@@ -38,7 +45,7 @@ class User(db.Model):
             'education': self.education,
             'income': self.income,
             'occupation': self.occupation,
-            'assigned_materials_count': len(self.assigned_materials),
+            'assigned_materials_count': assigned_materials_count,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
@@ -77,13 +84,13 @@ class Material(db.Model):
     type = db.Column(db.String(20), nullable=False)  # TEXT, VIDEO, HTML, AUDIO, EPUB
     content = db.Column(db.Text, nullable=False)  # 文本内容(TEXT/HTML), URL(VIDEO/AUDIO), 或本地文件路径(EPUB)
     cover_url = db.Column(db.String(255), nullable=True)
+    assigned_count = db.Column(db.Integer, nullable=False, default=0)  # 分配数计数缓存
+    read_count = db.Column(db.Integer, nullable=False, default=0)  # 已读数计数缓存
     created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(beijing_tz))
     updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(beijing_tz), onupdate=lambda: datetime.now(beijing_tz))
 
     def to_dict(self):
         """将模型转换为字典"""
-        assigned_count = len(self.assignments)
-        read_count = sum(1 for assignment in self.assignments if assignment.read_status)
         return {
             'id': self.id,
             'title': self.title,
@@ -91,9 +98,10 @@ class Material(db.Model):
             'type': self.type,
             'content': self.content,
             'coverUrl': self.cover_url,
+            'coverThumbUrl': thumb_url(self.id, self.cover_url),
             'assignedToUserIds': [assignment.user_id for assignment in self.assignments],
-            'assignedCount': assigned_count,
-            'readCount': read_count,
+            'assignedCount': self.assigned_count,
+            'readCount': self.read_count,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
@@ -114,6 +122,68 @@ class MaterialAssignment(db.Model):
 
     __table_args__ = (db.UniqueConstraint('material_id', 'user_id', name='_material_user_uc'),)
 
+class MaterialSegment(db.Model):
+    """材料分段模型，长文本(TEXT/HTML)按段落或标题预先切分"""
+    __tablename__ = 'material_segments'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    material_id = db.Column(db.String(36), db.ForeignKey('materials.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)  # 片段序号，从0开始
+    start_offset = db.Column(db.Integer, nullable=False)  # 在原文中的起始字符偏移
+    end_offset = db.Column(db.Integer, nullable=False)
+    heading = db.Column(db.String(255), nullable=True)
+    content = db.Column(db.Text, nullable=False)
+    checksum = db.Column(db.String(40), nullable=False)
+
+    # 关系
+    material = db.relationship('Material', backref=db.backref('segments', lazy=True))
+
+    __table_args__ = (db.UniqueConstraint('material_id', 'seq', name='_material_segment_uc'),)
+
+    def to_dict(self, include_content=True):
+        """将模型转换为字典"""
+        data = {
+            'seq': self.seq,
+            'start': self.start_offset,
+            'end': self.end_offset,
+            'length': self.end_offset - self.start_offset,
+            'heading': self.heading,
+            'checksum': self.checksum
+        }
+        if include_content:
+            data['content'] = self.content
+        return data
+
+class MaterialTerm(db.Model):
+    """材料全文检索倒排索引：每个材料的每个词条一行"""
+    __tablename__ = 'material_terms'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # MySQL 上使用二进制排序规则，避免不同假名/全半角字符在唯一约束上被视为相同；
+    # 其他数据库（如测试用的SQLite）没有该排序规则，且默认即按二进制比较
+    term = db.Column(db.String(64).with_variant(db.String(64, collation='utf8mb4_bin'), 'mysql'), nullable=False)
+    material_id = db.Column(db.String(36), db.ForeignKey('materials.id'), nullable=False)
+    weight = db.Column(db.Float, nullable=False)  # 各字段加权后的词频得分
+
+    __table_args__ = (
+        db.UniqueConstraint('material_id', 'term', name='_material_term_uc'),
+        db.Index('ix_material_terms_term_material', 'term', 'material_id'),
+    )
+
+class StoredFile(db.Model):
+    """上传文件名称到内容哈希的映射，文件内容按哈希存储（内容寻址）"""
+    __tablename__ = 'stored_files'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(10), nullable=False)  # epub, md
+    name = db.Column(db.String(255), nullable=False)  # 客户端提供的文件名
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(beijing_tz))
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(beijing_tz), onupdate=lambda: datetime.now(beijing_tz))
+
+    __table_args__ = (db.UniqueConstraint('kind', 'name', name='_stored_file_kind_name_uc'),)
+
 class Log(db.Model):
     """操作日志模型"""
     __tablename__ = 'logs'
@@ -123,12 +193,24 @@ class Log(db.Model):
     action = db.Column(db.String(50), nullable=False)  # 操作类型：LOGIN, LOGOUT, OPEN_MATERIAL, CLOSE_MATERIAL, AI_QUERY, etc.
     material_id = db.Column(db.String(36), db.ForeignKey('materials.id'), nullable=True)  # 可选，与材料相关的操作
     details = db.Column(db.Text, nullable=True)  # 操作详情，如AI查询内容等
+    ip = db.Column(db.String(45), nullable=True, index=True)
+    user_agent = db.Column(db.String(512), nullable=True)
+    content_length = db.Column(db.Integer, nullable=True)  # 详情内容的字符数
+    ai_query_type = db.Column(db.String(32), nullable=True)  # AI操作的查询类型：chat, summary 等
     created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(beijing_tz))
 
     # 关系
     user = db.relationship('User', backref=db.backref('logs', lazy=True))
     material = db.relationship('Material', backref=db.backref('logs', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_logs_user_created', 'user_id', 'created_at'),
+        db.Index('ix_logs_material_created', 'material_id', 'created_at'),
+        db.Index('ix_logs_action_created', 'action', 'created_at'),
+        # 不带过滤条件的列表与导出按 (created_at, id) 排序分页
+        db.Index('ix_logs_created_id', 'created_at', 'id'),
+    )
+
     def to_dict(self):
         """将模型转换为字典"""
         return {
@@ -137,9 +219,46 @@ class Log(db.Model):
             'action': self.action,
             'materialId': self.material_id,
             'details': self.details,
+            'ip': self.ip,
+            'userAgent': self.user_agent,
+            'contentLength': self.content_length,
+            'aiQueryType': self.ai_query_type,
             'createdAt': self.created_at.isoformat()
         }
 
+class ReadingSession(db.Model):
+    """阅读会话汇总表：由 OPEN_MATERIAL/CLOSE_MATERIAL 日志增量维护"""
+    __tablename__ = 'reading_sessions'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.String(20), db.ForeignKey('users.phone_number'), nullable=False)
+    material_id = db.Column(db.String(36), db.ForeignKey('materials.id'), nullable=False)
+    status = db.Column(db.String(10), nullable=False)  # OPEN, CLOSED, TIMED_OUT
+    opened_at = db.Column(db.DateTime, nullable=False)
+    closed_at = db.Column(db.DateTime, nullable=True)
+    duration_seconds = db.Column(db.Integer, nullable=True)  # 仅 CLOSED 会话有时长
+    # OPEN 会话为True，其余为NULL；唯一约束中NULL互不冲突，因此每个用户与材料最多一个OPEN会话
+    is_open = db.Column(db.Boolean, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'material_id', 'is_open', name='_reading_session_open_uc'),
+        db.Index('ix_reading_sessions_user_material_opened', 'user_id', 'material_id', 'opened_at'),
+        db.Index('ix_reading_sessions_material_status', 'material_id', 'status'),
+        db.Index('ix_reading_sessions_status_opened', 'status', 'opened_at'),
+    )
+
+    def to_dict(self):
+        """将模型转换为字典"""
+        return {
+            'id': self.id,
+            'userId': self.user_id,
+            'materialId': self.material_id,
+            'status': self.status,
+            'openedAt': self.opened_at.isoformat(),
+            'closedAt': self.closed_at.isoformat() if self.closed_at else None,
+            'durationSeconds': self.duration_seconds
+        }
+
 class MaterialFormConfig(db.Model):
     """实验配置表：材料与表单的关联"""
     __tablename__ = 'material_form_configs'
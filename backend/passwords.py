@@ -0,0 +1,101 @@
+# 密码哈希工具
+import os
+import threading
+import bcrypt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+DEFAULT_BCRYPT_ROUNDS = 12
+
+# bcrypt哈希格式前缀
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+
+# 批量哈希使用的进程池，首次使用时按需创建
+_hash_executor = None
+
+# 登录校验使用的有界线程池（bcrypt计算时会释放GIL）
+_verify_executor = None
+_verify_slots = None
+_verify_lock = threading.Lock()
+
+class PasswordPoolBusy(Exception):
+    """密码校验队列已满"""
+
+def hash_password(password, rounds=DEFAULT_BCRYPT_ROUNDS):
+    """使用bcrypt对密码进行哈希"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def hash_rounds(hashed):
+    """解析bcrypt哈希中的cost，非bcrypt格式返回None"""
+    if not hashed or not hashed.startswith(BCRYPT_PREFIXES):
+        return None
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+def check_password(password, stored, rounds=DEFAULT_BCRYPT_ROUNDS):
+    """校验密码，返回 (是否通过, 需要写回的新哈希或None)
+
+    兼容历史明文密码：明文匹配或cost与配置不一致时都会重新哈希。
+    """
+    if not isinstance(password, str):
+        return False, None
+    valid = False
+    current_rounds = hash_rounds(stored)
+    if current_rounds is not None:
+        try:
+            valid = bcrypt.checkpw(password.encode('utf-8'), stored.encode('utf-8'))
+        except ValueError:
+            valid = (stored == password)
+            current_rounds = None
+    else:
+        valid = (stored == password)
+
+    if valid and current_rounds != rounds:
+        return True, hash_password(password, rounds)
+    return valid, None
+
+def _get_hash_executor(max_workers=None):
+    """获取（必要时创建）批量哈希进程池"""
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+    return _hash_executor
+
+def hash_passwords(passwords, max_workers=None, rounds=DEFAULT_BCRYPT_ROUNDS):
+    """在进程池中批量哈希密码，返回与输入顺序一致的列表，空密码返回None"""
+    indexed = [(i, p) for i, p in enumerate(passwords) if p]
+    result = [None] * len(passwords)
+    if not indexed:
+        return result
+
+    executor = _get_hash_executor(max_workers)
+    chunksize = max(1, len(indexed) // ((max_workers or os.cpu_count() or 1) * 4))
+    hashed = executor.map(partial(hash_password, rounds=rounds), [p for _, p in indexed], chunksize=chunksize)
+    for (i, _), value in zip(indexed, hashed):
+        result[i] = value
+    return result
+
+def _get_verify_executor(max_workers, queue_depth):
+    """获取（必要时创建）登录校验线程池及其排队名额"""
+    global _verify_executor, _verify_slots
+    if _verify_executor is None:
+        with _verify_lock:
+            if _verify_executor is None:
+                _verify_slots = threading.BoundedSemaphore(max_workers + queue_depth)
+                _verify_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pwcheck')
+    return _verify_executor, _verify_slots
+
+def check_password_bounded(password, stored, rounds, max_workers, queue_depth, timeout):
+    """在有界线程池中校验密码，排队已满时抛出 PasswordPoolBusy"""
+    executor, slots = _get_verify_executor(max_workers, queue_depth)
+    if not slots.acquire(blocking=False):
+        raise PasswordPoolBusy()
+    try:
+        future = executor.submit(check_password, password, stored, rounds)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future.result(timeout=timeout)
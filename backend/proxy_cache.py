@@ -0,0 +1,347 @@
+# 图片代理缓存：内存LRU（小图）+ 容量受限的磁盘缓存，按URL为键
+# 遵循上游 Cache-Control/Expires/ETag，过期后先返回旧内容并在后台重新验证（no-cache 的内容须先验证再返回）；
+# 同一URL的并发未命中只向上游发起一次请求（single-flight）
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+import http_client
+import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, 'proxy_cache')
+
+# 伪造 Referer 头部，解决防盗链问题
+UPSTREAM_HEADERS = {
+    'Referer': 'https://movie.douban.com',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+stats = metrics.register('proxy_cache', metrics.Counters())
+
+class UpstreamError(Exception):
+    """上游返回非200状态"""
+
+    def __init__(self, status):
+        super().__init__(f'Failed to fetch image, status: {status}')
+        self.status = status
+
+class TooLarge(Exception):
+    """响应超过可缓存大小，调用方应直接流式转发"""
+
+class _Flight:
+    """一次进行中的上游请求，后到的请求等待其结果"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+def _cache_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+def _cache_directives(headers):
+    directives = {}
+    for part in headers.get('Cache-Control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+def _freshness(headers, default_ttl):
+    """根据上游缓存头计算可缓存秒数，返回None表示不可缓存"""
+    directives = _cache_directives(headers)
+    if 'no-store' in directives or 'private' in directives:
+        return None
+    if 'no-cache' in directives:
+        return 0
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            try:
+                return max(0, int(directives[name]))
+            except ValueError:
+                pass
+    if headers.get('Expires'):
+        try:
+            return max(0, int(parsedate_to_datetime(headers['Expires']).timestamp() - time.time()))
+        except (TypeError, ValueError):
+            return 0
+    return default_ttl
+
+class ImageProxyCache:
+    """两级图片缓存"""
+
+    def __init__(self, memory_max_bytes, memory_item_max, disk_max_bytes, max_object_size, default_ttl, timeout):
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_item_max = memory_item_max
+        self.disk_max_bytes = disk_max_bytes
+        self.max_object_size = max_object_size
+        self.default_ttl = default_ttl
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None  # 首次写入时扫描目录得到
+        self._flights = {}
+        self._revalidating = set()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='proxy-revalidate')
+
+    def get(self, url):
+        """返回 (元数据, 内容, 缓存状态)；状态为 HIT / STALE / REVALIDATED / MISS"""
+        key = _cache_key(url)
+        entry = self._load(key)
+        if entry:
+            meta, body = entry
+            if meta['expires_at'] > time.time():
+                return meta, body, 'HIT'
+            if meta.get('no_cache'):
+                # 上游要求每次使用前验证，不能先返回旧内容，验证失败时直接报错
+                stats.incr('revalidate_sync')
+                meta, body = self._single_flight(key, lambda: self._fetch(key, url, previous=entry))
+                return meta, body, 'REVALIDATED'
+            stats.incr('stale')
+            self._schedule_revalidate(key, url, entry)
+            return meta, body, 'STALE'
+
+        stats.incr('miss')
+        meta, body = self._single_flight(key, lambda: self._fetch(key, url))
+        return meta, body, 'MISS'
+
+    # 读取
+
+    def _load(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None:
+            stats.incr('hit_memory')
+            return entry
+
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        # 更新访问时间，磁盘淘汰按最近访问顺序进行
+        try:
+            os.utime(body_path)
+        except OSError:
+            pass
+        stats.incr('hit_disk')
+        self._remember(key, meta, body)
+        return meta, body
+
+    def _paths(self, key):
+        directory = os.path.join(CACHE_DIR, key[:2])
+        return os.path.join(directory, key + '.bin'), os.path.join(directory, key + '.json')
+
+    # 上游请求
+
+    def _single_flight(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            stats.incr('coalesced')
+            flight.event.wait(self.timeout * 2)
+            if flight.error is not None:
+                raise flight.error
+            if flight.result is None:
+                raise TimeoutError('Timed out waiting for upstream fetch')
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def _fetch(self, key, url, previous=None):
+        """请求上游，返回 (元数据, 内容)；previous 为旧的 (元数据, 内容)，用于条件请求，304时沿用旧内容"""
+        headers = dict(UPSTREAM_HEADERS)
+        if previous:
+            previous_meta = previous[0]
+            if previous_meta.get('etag'):
+                headers['If-None-Match'] = previous_meta['etag']
+            if previous_meta.get('last_modified'):
+                headers['If-Modified-Since'] = previous_meta['last_modified']
+
+        stats.incr('upstream_requests')
+        with http_client.get(url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            if resp.status_code == 304 and previous:
+                stats.incr('revalidated')
+                previous_meta, body = previous
+                ttl = _freshness(resp.headers, self.default_ttl)
+                meta = dict(previous_meta, expires_at=time.time() + (ttl or 0))
+                # 304 带有缓存头时以新的为准
+                if 'Cache-Control' in resp.headers:
+                    meta['no_cache'] = 'no-cache' in _cache_directives(resp.headers)
+                if ttl is not None:
+                    self._store(key, meta, body)
+                return meta, body
+            if resp.status_code != 200:
+                raise UpstreamError(resp.status_code)
+
+            length = resp.headers.get('Content-Length')
+            if length and length.isdigit() and int(length) > self.max_object_size:
+                stats.incr('uncacheable')
+                raise TooLarge()
+
+            chunks = []
+            size = 0
+            for chunk in resp.iter_content(chunk_size=http_client.chunk_size(resp)):
+                size += len(chunk)
+                if size > self.max_object_size:
+                    stats.incr('uncacheable')
+                    raise TooLarge()
+                chunks.append(chunk)
+            body = b''.join(chunks)
+
+            ttl = _freshness(resp.headers, self.default_ttl)
+            meta = {
+                'url': url,
+                'content_type': resp.headers.get('Content-Type'),
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'size': len(body),
+                'expires_at': time.time() + (ttl or 0),
+                'no_cache': 'no-cache' in _cache_directives(resp.headers)
+            }
+        if ttl is None:
+            stats.incr('uncacheable')
+        else:
+            self._store(key, meta, body)
+        return meta, body
+
+    def _schedule_revalidate(self, key, url, entry):
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+        self._executor.submit(self._revalidate, key, url, entry)
+
+    def _revalidate(self, key, url, entry):
+        try:
+            self._single_flight(key, lambda: self._fetch(key, url, previous=entry))
+        except Exception as e:
+            # 重新验证失败时继续使用旧内容
+            stats.incr('revalidate_errors')
+            print(f"Proxy revalidate error ({url}): {e}")
+        finally:
+            with self._lock:
+                self._revalidating.discard(key)
+
+    # 写入与淘汰
+
+    def _remember(self, key, meta, body):
+        if len(body) > self.memory_item_max:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_size -= len(previous[1])
+            self._memory[key] = (meta, body)
+            self._memory_size += len(body)
+            while self._memory_size > self.memory_max_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _store(self, key, meta, body):
+        self._remember(key, meta, body)
+
+        body_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        try:
+            old_size = os.path.getsize(body_path)
+        except OSError:
+            old_size = 0
+
+        # 先写内容再写元数据，读取时元数据存在即表示内容完整
+        suffix = f'.{uuid.uuid4().hex}.tmp'
+        with open(body_path + suffix, 'wb') as f:
+            f.write(body)
+        os.replace(body_path + suffix, body_path)
+        with open(meta_path + suffix, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + suffix, meta_path)
+
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = self._scan_disk_size()
+            else:
+                self._disk_size += len(body) - old_size
+            over_limit = self._disk_size > self.disk_max_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _scan_disk_size(self):
+        total = 0
+        for root, _, files in os.walk(CACHE_DIR):
+            total += sum(os.path.getsize(os.path.join(root, name)) for name in files if name.endswith('.bin'))
+        return total
+
+    def _evict_disk(self):
+        """按最近访问时间淘汰磁盘缓存，降到上限的90%"""
+        entries = []
+        for root, _, files in os.walk(CACHE_DIR):
+            for name in files:
+                if name.endswith('.bin'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            for victim in (path[:-len('.bin')] + '.json', path):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+            stats.incr('disk_evictions')
+        with self._lock:
+            self._disk_size = total
+
+_instance = None
+_instance_lock = threading.Lock()
+
+def get_cache(config):
+    """按应用配置获取（必要时创建）进程内缓存实例"""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = ImageProxyCache(
+                    memory_max_bytes=config['PROXY_CACHE_MEMORY_MAX_BYTES'],
+                    memory_item_max=config['PROXY_CACHE_MEMORY_ITEM_MAX'],
+                    disk_max_bytes=config['PROXY_CACHE_DISK_MAX_BYTES'],
+                    max_object_size=config['PROXY_CACHE_MAX_OBJECT_SIZE'],
+                    default_ttl=config['PROXY_CACHE_DEFAULT_TTL'],
+                    timeout=config['PROXY_FETCH_TIMEOUT']
+                )
+    return _instance
@@ -0,0 +1,199 @@
+# 阅读会话汇总（reading_sessions）维护：按 OPEN_MATERIAL/CLOSE_MATERIAL 事件配对
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from db import db
+from models import beijing_tz, User, Log, ReadingSession
+
+OPEN_ACTION = 'OPEN_MATERIAL'
+CLOSE_ACTION = 'CLOSE_MATERIAL'
+SESSION_ACTIONS = (OPEN_ACTION, CLOSE_ACTION)
+
+STATUS_OPEN = 'OPEN'
+STATUS_CLOSED = 'CLOSED'
+STATUS_TIMED_OUT = 'TIMED_OUT'
+
+def transition(opened_at, action, at, timeout):
+    """根据当前打开会话的开始时间与新事件计算状态变化
+
+    返回 (结束的会话字段或None, 新会话开始时间或None)。关闭事件在超时时间内到达时记为CLOSED；
+    未配对的打开（再次打开或超时后才关闭）记为TIMED_OUT，不计时长。
+    """
+    finished = None
+    if opened_at is not None:
+        elapsed = (at - opened_at).total_seconds()
+        if action == CLOSE_ACTION and 0 <= elapsed <= timeout:
+            finished = {'status': STATUS_CLOSED, 'closed_at': at, 'duration_seconds': int(round(elapsed))}
+        else:
+            finished = {'status': STATUS_TIMED_OUT, 'closed_at': None, 'duration_seconds': None}
+    return finished, (at if action == OPEN_ACTION else None)
+
+def _session_row(user_id, material_id, opened_at, finished):
+    """会话表行；未结束的会话占用 is_open 唯一槽位，同一用户与材料最多一行OPEN"""
+    if finished:
+        return {'user_id': user_id, 'material_id': material_id, 'opened_at': opened_at, 'is_open': None, **finished}
+    return {'user_id': user_id, 'material_id': material_id, 'opened_at': opened_at, 'is_open': True,
+            'status': STATUS_OPEN, 'closed_at': None, 'duration_seconds': None}
+
+def replay(user_id, material_id, since, timeout, now=None):
+    """在当前事务中按日志时间重新配对某用户某材料自 since 起的会话
+
+    新事件只影响它之前最近一次打开之后的配对，因此从该次打开开始删除并重放，
+    与事件到达顺序无关（写后缓冲下关闭事件可能先于打开事件写入）。
+    """
+    previous_open = db.session.query(db.func.max(Log.created_at)).filter(
+        Log.user_id == user_id, Log.material_id == material_id,
+        Log.action == OPEN_ACTION, Log.created_at < since
+    ).scalar()
+    start = min(previous_open, since) if previous_open else since
+
+    ReadingSession.query.filter(
+        ReadingSession.user_id == user_id, ReadingSession.material_id == material_id,
+        ReadingSession.opened_at >= start
+    ).delete(synchronize_session=False)
+
+    events = db.session.execute(
+        db.select(Log.action, Log.created_at).where(
+            Log.user_id == user_id, Log.material_id == material_id,
+            Log.action.in_(SESSION_ACTIONS), Log.created_at >= start
+        ).order_by(Log.created_at, Log.id)
+    ).all()
+    pending = []
+    opened_at = None
+    for event in events:
+        finished, next_opened_at = transition(opened_at, event.action, event.created_at, timeout)
+        if finished:
+            pending.append(_session_row(user_id, material_id, opened_at, finished))
+        opened_at = next_opened_at
+    if opened_at:
+        finished = None
+        if opened_at < _naive(now or datetime.now(beijing_tz)) - timedelta(seconds=timeout):
+            finished = {'status': STATUS_TIMED_OUT, 'closed_at': None, 'duration_seconds': None}
+        pending.append(_session_row(user_id, material_id, opened_at, finished))
+    if pending:
+        db.session.execute(db.insert(ReadingSession), pending)
+
+def apply_rows(rows, timeout):
+    """按一批日志行（Log 列名到值的字典）更新阅读会话，日志需已在当前事务中写入
+
+    同一用户与材料在批内只从最早的事件重放一次；并发写入同一会话槽位失败时跳过，
+    之后该用户与材料的下一次事件或 rebuild-reading-sessions 会重新配对。
+    """
+    earliest = {}
+    for row in rows:
+        if row['action'] in SESSION_ACTIONS and row.get('material_id'):
+            key = (row['user_id'], row['material_id'])
+            created_at = _naive(row['created_at'])
+            if key not in earliest or created_at < earliest[key]:
+                earliest[key] = created_at
+    if not earliest:
+        return
+    db.session.flush()
+    for (user_id, material_id), since in earliest.items():
+        try:
+            with db.session.begin_nested():
+                replay(user_id, material_id, since, timeout)
+        except IntegrityError as e:
+            print(f"Reading session replay conflict ({user_id}, {material_id}): {e}")
+
+def expire_stale(timeout, now=None):
+    """将超过超时时间仍未关闭的会话标记为TIMED_OUT，返回更新数量
+
+    只用于整理会话表（expire-reading-sessions 命令）；汇总查询在读取时即把这些会话计为超时。
+    """
+    now = _naive(now or datetime.now(beijing_tz))
+    return ReadingSession.query.filter(
+        ReadingSession.status == STATUS_OPEN,
+        ReadingSession.opened_at < now - timedelta(seconds=timeout)
+    ).update({
+        ReadingSession.status: STATUS_TIMED_OUT,
+        ReadingSession.is_open: None
+    }, synchronize_session=False)
+
+def rebuild(timeout, batch_size=5000):
+    """清空并按时间顺序重放历史日志重建会话表，返回写入的会话数"""
+    ReadingSession.query.delete()
+    db.session.commit()
+
+    # 未关闭的会话只保存在内存中，按 (用户, 材料) 记录开始时间
+    open_sessions = {}
+    written = 0
+    last = None
+    while True:
+        query = db.select(Log.id, Log.user_id, Log.action, Log.material_id, Log.created_at).where(
+            Log.action.in_(SESSION_ACTIONS), Log.material_id.isnot(None)
+        )
+        if last:
+            query = query.where(db.or_(
+                Log.created_at > last[0],
+                db.and_(Log.created_at == last[0], Log.id > last[1])
+            ))
+        rows = db.session.execute(query.order_by(Log.created_at, Log.id).limit(batch_size)).all()
+        if not rows:
+            break
+
+        pending = []
+        for row in rows:
+            key = (row.user_id, row.material_id)
+            previous = open_sessions.pop(key, None)
+            finished, opened_at = transition(previous, row.action, row.created_at, timeout)
+            if finished:
+                pending.append(_session_row(row.user_id, row.material_id, previous, finished))
+            if opened_at:
+                open_sessions[key] = opened_at
+        last = (rows[-1].created_at, rows[-1].id)
+        written += _insert_sessions(pending)
+
+    pending = [_session_row(user_id, material_id, opened_at, None)
+               for (user_id, material_id), opened_at in open_sessions.items()]
+    written += _insert_sessions(pending)
+    expire_stale(timeout)
+    db.session.commit()
+    return written
+
+def totals(by, timeout, user_id=None, material_id=None, group=None, since=None, until=None, now=None):
+    """按用户、材料或分组汇总已结束会话的次数与时长，时间范围按会话开始时间过滤
+
+    只读查询：超过超时时间仍为OPEN的会话在这里直接计为超时，不回写会话表。
+    """
+    cutoff = _naive(now or datetime.now(beijing_tz)) - timedelta(seconds=timeout)
+    stale = db.and_(ReadingSession.status == STATUS_OPEN, ReadingSession.opened_at < cutoff)
+    key = {
+        'user': ReadingSession.user_id,
+        'material': ReadingSession.material_id,
+        'group': User.group
+    }[by]
+    closed = db.case((ReadingSession.status == STATUS_CLOSED, 1), else_=0)
+    timed_out = db.case((db.or_(ReadingSession.status == STATUS_TIMED_OUT, stale), 1), else_=0)
+    query = db.select(
+        key.label('key'),
+        db.func.sum(closed).label('sessions'),
+        db.func.coalesce(db.func.sum(ReadingSession.duration_seconds), 0).label('total_seconds'),
+        db.func.sum(timed_out).label('timed_out'),
+        db.func.count(db.distinct(ReadingSession.user_id)).label('users')
+    ).where(db.or_(ReadingSession.status != STATUS_OPEN, stale))
+
+    if by == 'group' or group is not None:
+        query = query.join(User, User.phone_number == ReadingSession.user_id)
+    if user_id:
+        query = query.where(ReadingSession.user_id == user_id)
+    if material_id:
+        query = query.where(ReadingSession.material_id == material_id)
+    if group is not None:
+        query = query.where(User.group == group)
+    if since:
+        query = query.where(ReadingSession.opened_at >= since)
+    if until:
+        query = query.where(ReadingSession.opened_at < until)
+    return db.session.execute(query.group_by(key).order_by(key)).all()
+
+def _insert_sessions(rows):
+    if rows:
+        db.session.execute(db.insert(ReadingSession), rows)
+        db.session.commit()
+    return len(rows)
+
+def _naive(value):
+    """数据库按北京时间存储不带时区的时间"""
+    if value.tzinfo is not None:
+        value = value.astimezone(beijing_tz).replace(tzinfo=None)
+    return value
@@ -1,68 +1,196 @@
 # API路由
-from flask import Blueprint, request, jsonify, send_from_directory, Response, stream_with_context
-from models import User, Material, MaterialAssignment, Log, Form, MaterialFormConfig, UserResponse
+from flask import Blueprint, request, jsonify, send_from_directory, Response, stream_with_context, current_app, redirect
+from models import beijing_tz, User, Material, MaterialAssignment, MaterialSegment, MaterialTerm, Log, ReadingSession, Form, MaterialFormConfig, UserResponse
 from db import db
+from auth import issue_token, auth_required, get_current_claims, is_admin, forbid_other_user
+from conditional import make_etag, not_modified, with_validators
+from counters import adjust_material_counters, release_user_assignments, refresh_material_counters
+from segments import build_segments, SEGMENTED_TYPES
+from search import query_terms, reindex_material
+import storage
+import epub_index
+import md_render
+import covers
+import proxy_cache
+import http_client
+import log_buffer
+from log_details import structured_fields
+import reading_sessions
+import uploads
+from passwords import hash_password, hash_passwords, check_password_bounded, PasswordPoolBusy
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import metrics
+from datetime import datetime
+import time
+import csv
+import io
+import zlib
 import json
-import bcrypt
 import os
+from urllib.parse import quote
 import requests
 
 # 创建蓝图
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# 登录耗时指标
+login_latency = metrics.register('login', metrics.LatencyRecorder())
+
+def _table_version(model, *criteria):
+    """表（或筛选范围）的版本：记录数与最大更新时间"""
+    return db.session.query(db.func.count(), db.func.max(model.updated_at)).select_from(model).filter(*criteria).one()
+
+def _assignment_version(*criteria):
+    """分配记录的版本：记录数、最大ID与已读数，任何分配或已读变化都会改变它"""
+    return db.session.query(
+        db.func.count(MaterialAssignment.id),
+        db.func.max(MaterialAssignment.id),
+        db.func.sum(db.case((MaterialAssignment.read_status == True, 1), else_=0))
+    ).filter(*criteria).one()
+
+def _parse_page_args():
+    """解析游标分页参数，未携带 limit/cursor 时返回 (None, None) 表示不分页"""
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit', type=int)
+    if limit is None and cursor is None:
+        return None, None
+    if not limit or limit < 1:
+        limit = current_app.config['DEFAULT_PAGE_SIZE']
+    return min(limit, current_app.config['MAX_PAGE_SIZE']), cursor
+
+def _proxy_unavailable(e):
+    """上游暂时不可用（主机并发已满、连接失败或超时）时返回503，提示客户端稍后重试"""
+    print(f"Proxy upstream unavailable: {e}")
+    if isinstance(e, http_client.HostBusy):
+        return jsonify({'error': 'Upstream host busy, please retry'}), 503, {'Retry-After': '1'}
+    return jsonify({'error': 'Failed to fetch image from upstream, please retry'}), 503, {'Retry-After': '5'}
+
 @api_bp.route('/proxy', methods=['GET'])
 def proxy_image():
-    """代理图片请求，解决防盗链问题"""
+    """代理图片请求，解决防盗链问题；结果经两级缓存，并发请求同一图片只访问一次上游"""
     image_url = request.args.get('url')
     if not image_url:
         return jsonify({'error': 'No URL provided'}), 400
-        
+
+    cache = proxy_cache.get_cache(current_app.config)
+    try:
+        meta, body, state = cache.get(image_url)
+    except proxy_cache.UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status
+    except proxy_cache.TooLarge:
+        return _stream_proxy(image_url)
+    except (requests.RequestException, TimeoutError) as e:
+        # 包括 http_client.HostBusy 与等待同一URL的进行中请求超时
+        return _proxy_unavailable(e)
+    except Exception as e:
+        print(f"Proxy error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    response = Response(body, content_type=meta['content_type'])
+    max_age = max(0, int(meta['expires_at'] - time.time()))
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    response.headers['X-Cache'] = state
+    if meta.get('etag'):
+        response.headers['ETag'] = meta['etag']
+    if meta.get('last_modified'):
+        response.headers['Last-Modified'] = meta['last_modified']
+    return response.make_conditional(request)
+
+def _stream_proxy(image_url):
+    """不适合缓存的大图片直接流式转发"""
     try:
-        # 伪造 Referer 头部
-        headers = {
-            'Referer': 'https://movie.douban.com',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
         # 发起请求, stream=True 用于流式传输
-        resp = requests.get(image_url, headers=headers, stream=True, timeout=10)
+        resp = http_client.get(image_url, headers=proxy_cache.UPSTREAM_HEADERS, stream=True,
+                               timeout=current_app.config['PROXY_FETCH_TIMEOUT'])
         
         # 检查响应状态
         if resp.status_code != 200:
+            resp.close()
             return jsonify({'error': f'Failed to fetch image, status: {resp.status_code}'}), resp.status_code
             
-        # 获取内容类型
-        content_type = resp.headers.get('content-type')
-        
-        # 排除非图片类型 (可选)
-        # if 'image' not in content_type:
-        #     return jsonify({'error': 'URL is not an image'}), 400
-            
-        # 创建流式响应
-        return Response(
-            stream_with_context(resp.iter_content(chunk_size=1024)), 
-            content_type=content_type
+        # 创建流式响应，分块大小按响应长度选择
+        out = Response(
+            stream_with_context(http_client.iter_body(resp)), 
+            content_type=resp.headers.get('content-type')
         )
+        # 生成器可能从未开始迭代（HEAD请求、客户端提前断开），由响应关闭时归还连接与主机并发名额
+        out.call_on_close(resp.close)
+        return out
             
+    except requests.RequestException as e:
+        return _proxy_unavailable(e)
     except Exception as e:
         print(f"Proxy error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/users', methods=['GET'])
+@auth_required('ADMIN')
 def get_users():
-    """获取所有用户"""
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    """获取用户列表，支持 role/group 筛选与游标分页(limit/cursor)"""
+    limit, cursor = _parse_page_args()
+
+    # 条件请求：用户表与分配表均未变化时直接返回304
+    # 分配统计的变化不会体现在updated_at上，因此仅依据ETag判断
+    user_count, last_modified = _table_version(User)
+    etag = make_etag('users', request.query_string.decode(), user_count, last_modified, *_assignment_version())
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    # 通过 GROUP BY 子查询一次性统计每个用户的分配数量，避免逐个用户加载分配记录
+    counts = db.session.query(
+        MaterialAssignment.user_id.label('user_id'),
+        db.func.count(MaterialAssignment.id).label('assigned_count')
+    ).group_by(MaterialAssignment.user_id).subquery()
+
+    query = db.session.query(User, db.func.coalesce(counts.c.assigned_count, 0)) \
+        .outerjoin(counts, counts.c.user_id == User.phone_number)
+
+    role = request.args.get('role')
+    if role:
+        query = query.filter(User.role == role)
+    group = request.args.get('group')
+    if group:
+        query = query.filter(User.group == group)
+
+    query = query.order_by(User.phone_number)
+
+    # 未携带分页参数时保持原有的数组返回格式
+    if limit is None:
+        response = jsonify([user.to_dict(assigned_materials_count=count) for user, count in query.all()])
+        return with_validators(response, etag, last_modified)
+
+    # 键集分页：以上一页最后一个手机号作为游标
+    if cursor:
+        query = query.filter(User.phone_number > cursor)
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    response = jsonify({
+        'items': [user.to_dict(assigned_materials_count=count) for user, count in rows],
+        'nextCursor': rows[-1][0].phone_number if has_more else None,
+        'hasMore': has_more
+    })
+    return with_validators(response, etag, last_modified)
 
 @api_bp.route('/users/<string:phone_number>', methods=['GET'])
+@auth_required('ADMIN', self_param='phone_number')
 def get_user(phone_number):
     """获取单个用户"""
     user = User.query.get(phone_number)
     if not user:
         return jsonify({'error': 'User not found'}), 404
-    return jsonify(user.to_dict())
+
+    assigned_count, max_assignment_id, _ = _assignment_version(MaterialAssignment.user_id == phone_number)
+    etag = make_etag('user', user.phone_number, user.updated_at, assigned_count, max_assignment_id)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    return with_validators(jsonify(user.to_dict(assigned_materials_count=assigned_count)), etag, user.updated_at)
 
 @api_bp.route('/users', methods=['POST'])
+@auth_required('ADMIN')
 def create_user():
     """创建用户"""
     data = request.get_json()
@@ -82,7 +210,7 @@ def create_user():
 
     # 创建新用户，对密码进行加密
     password = data.get('password')
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8') if password else None
+    hashed_password = hash_password(password, current_app.config['BCRYPT_ROUNDS']) if password else None
     
     new_user = User(
         phone_number=data['phone_number'],
@@ -106,7 +234,149 @@ def create_user():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+# 批量导入支持的用户字段
+BULK_USER_FIELDS = ['phone_number', 'name', 'email', 'role', 'group', 'password',
+                    'age', 'gender', 'education', 'income', 'occupation']
+BULK_USER_INT_FIELDS = ('age', 'income')
+
+def _read_bulk_user_rows():
+    """从请求中读取批量导入的用户数据，支持JSON数组和CSV（文件上传或text/csv请求体）
+
+    CSV无法解码或解析时抛出 ValueError。
+    """
+    try:
+        if 'file' in request.files:
+            text = request.files['file'].read().decode('utf-8-sig')
+        elif request.mimetype == 'text/csv':
+            text = request.get_data().decode('utf-8-sig')
+        else:
+            data = request.get_json(silent=True)
+            if isinstance(data, dict):
+                data = data.get('users')
+            return data if isinstance(data, list) else None
+
+        rows = []
+        for row in csv.DictReader(io.StringIO(text)):
+            # CSV中的空字符串视为未填写；多出的列（键为None）忽略
+            rows.append({k.strip(): (v.strip() or None) for k, v in row.items() if isinstance(k, str) and isinstance(v, str)})
+        return rows
+    except UnicodeDecodeError:
+        raise ValueError('CSV must be UTF-8 encoded')
+    except csv.Error as e:
+        raise ValueError(f'Invalid CSV: {e}')
+
+def _bulk_user_value(row):
+    """校验并转换单行字段类型，返回 (插入值, 错误信息)"""
+    value = {}
+    for field in BULK_USER_FIELDS:
+        item = row.get(field)
+        if item is None:
+            value[field] = None
+        elif field in BULK_USER_INT_FIELDS:
+            # 布尔值是int的子类，需单独排除
+            if isinstance(item, bool) or not isinstance(item, (int, str)):
+                return None, f'Invalid numeric field: {field}'
+            try:
+                value[field] = int(item) if item != '' else None
+            except ValueError:
+                return None, f'Invalid numeric field: {field}'
+        elif field == 'phone_number' and isinstance(item, int) and not isinstance(item, bool):
+            value[field] = str(item)
+        elif isinstance(item, str):
+            value[field] = item
+        else:
+            return None, f'Invalid field type: {field}'
+    return value, None
+
+@api_bp.route('/users/bulk', methods=['POST'])
+@auth_required('ADMIN')
+def bulk_create_users():
+    """批量导入用户（JSON或CSV），返回逐行导入结果"""
+    try:
+        rows = _read_bulk_user_rows()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not rows:
+        return jsonify({'error': 'No data provided'}), 400
+
+    results = [None] * len(rows)
+    candidates = []
+    seen_phones, seen_emails = set(), set()
+
+    # 逐行校验必填字段、字段类型及批次内重复
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            results[index] = {'row': index, 'status': 'error', 'error': 'Invalid row'}
+            continue
+        value, error = _bulk_user_value(row)
+        if error:
+            results[index] = {'row': index, 'status': 'error', 'error': error}
+            continue
+        missing = [f for f in ['phone_number', 'name', 'role'] if not value[f]]
+        if missing:
+            results[index] = {'row': index, 'phone_number': value['phone_number'], 'status': 'error',
+                              'error': f'Missing required field: {missing[0]}'}
+            continue
+        phone, email = value['phone_number'], value['email']
+        if phone in seen_phones or (email and email in seen_emails):
+            results[index] = {'row': index, 'phone_number': phone, 'status': 'skipped',
+                              'error': 'Duplicate in import'}
+            continue
+        seen_phones.add(phone)
+        if email:
+            seen_emails.add(email)
+        candidates.append((index, value))
+
+    # 一次集合查询找出已存在的手机号和邮箱
+    existing_phones, existing_emails = set(), set()
+    if candidates:
+        existing = db.session.query(User.phone_number, User.email).filter(db.or_(
+            User.phone_number.in_(seen_phones),
+            User.email.in_(seen_emails) if seen_emails else db.false()
+        )).all()
+        existing_phones = {phone for phone, _ in existing}
+        existing_emails = {email for _, email in existing if email}
+
+    to_insert = []
+    for index, row in candidates:
+        phone = row['phone_number']
+        if phone in existing_phones:
+            results[index] = {'row': index, 'phone_number': phone, 'status': 'skipped', 'error': 'User already exists'}
+        elif row['email'] in existing_emails:
+            results[index] = {'row': index, 'phone_number': phone, 'status': 'skipped', 'error': 'Email already exists'}
+        else:
+            to_insert.append((index, row))
+
+    try:
+        # 在进程池中并行哈希密码
+        hashed = hash_passwords([row['password'] for _, row in to_insert],
+                                max_workers=current_app.config['PASSWORD_HASH_WORKERS'],
+                                rounds=current_app.config['BCRYPT_ROUNDS'])
+
+        values = [dict(row, password=hashed_password) for (_, row), hashed_password in zip(to_insert, hashed)]
+
+        # 按批次执行多行INSERT
+        batch_size = current_app.config['BULK_INSERT_BATCH_SIZE']
+        for start in range(0, len(values), batch_size):
+            db.session.execute(User.__table__.insert(), values[start:start + batch_size])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    for index, row in to_insert:
+        results[index] = {'row': index, 'phone_number': row['phone_number'], 'status': 'created'}
+
+    # 没有新建任何用户时返回200，201仅表示确有资源被创建
+    return jsonify({
+        'created': len(to_insert),
+        'skipped': sum(1 for r in results if r['status'] == 'skipped'),
+        'failed': sum(1 for r in results if r['status'] == 'error'),
+        'results': results
+    }), 201 if to_insert else 200
+
 @api_bp.route('/users/<string:phone_number>', methods=['PUT'])
+@auth_required('ADMIN', self_param='phone_number')
 def update_user(phone_number):
     """更新用户"""
     user = User.query.get(phone_number)
@@ -122,15 +392,14 @@ def update_user(phone_number):
         user.name = data['name']
     if 'email' in data:
         user.email = data['email']
-    if 'role' in data:
+    # 角色与分组只能由管理员修改
+    if 'role' in data and is_admin():
         user.role = data['role']
-    if 'group' in data:
+    if 'group' in data and is_admin():
         user.group = data['group']
     if 'password' in data:
         # 对密码进行加密
-        password = data['password']
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        user.password = hashed_password
+        user.password = hash_password(data['password'], current_app.config['BCRYPT_ROUNDS'])
     if 'age' in data:
         user.age = data['age'] if data['age'] else None
     if 'gender' in data:
@@ -155,6 +424,7 @@ def update_user(phone_number):
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/users/<string:phone_number>', methods=['DELETE'])
+@auth_required('ADMIN')
 def delete_user(phone_number):
     """删除用户"""
     user = User.query.get(phone_number)
@@ -163,9 +433,11 @@ def delete_user(phone_number):
 
     try:
         # 手动删除相关联的记录
-        # 1. 删除日志
+        # 1. 删除日志及阅读会话
         Log.query.filter_by(user_id=phone_number).delete()
-        # 2. 删除材料分配
+        ReadingSession.query.filter_by(user_id=phone_number).delete()
+        # 2. 删除材料分配（先扣减材料计数）
+        release_user_assignments(phone_number)
         MaterialAssignment.query.filter_by(user_id=phone_number).delete()
         # 3. 删除用户答卷
         UserResponse.query.filter_by(user_id=phone_number).delete()
@@ -188,6 +460,8 @@ def login():
     # 检查必填字段
     if 'phone_number' not in data:
         return jsonify({'error': 'Missing required field: phone_number'}), 400
+    if not isinstance(data['phone_number'], str):
+        return jsonify({'error': 'Invalid phone_number'}), 400
 
     # 查找用户
     user = User.query.get(data['phone_number'])
@@ -197,59 +471,204 @@ def login():
     # 密码验证逻辑
     if 'password' not in data:
         return jsonify({'error': 'Missing required field: password'}), 400
-    
-    # 密码验证逻辑
-    password_valid = False
-    
+    # 提交到校验线程池之前检查类型，null或数字等会在编码时出错
+    if not isinstance(data['password'], str):
+        return jsonify({'error': 'Invalid password'}), 400
+
+    # 在有界线程池中校验密码，避免bcrypt计算阻塞所有请求线程
+    start = login_latency.time()
     try:
-        # 尝试使用bcrypt验证密码
-        # 检查user.password是否已经是bcrypt哈希格式（以$2b$开头）
-        if user.password and user.password.startswith('$2b$'):
-            # 如果是bcrypt哈希，直接使用
-            password_valid = bcrypt.checkpw(data.get('password').encode('utf-8'), user.password.encode('utf-8'))
-        else:
-            # 否则，尝试直接比较明文密码
-            password_valid = (user.password == data.get('password'))
-            
-            # 如果明文密码匹配，自动将其转换为bcrypt哈希并更新数据库
-            if password_valid:
-                hashed_password = bcrypt.hashpw(data.get('password').encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-                user.password = hashed_password
-                db.session.commit()
-    except Exception as e:
-        # 如果验证失败，尝试直接比较明文密码
-        password_valid = (user.password == data.get('password'))
-        
-        # 如果明文密码匹配，自动将其转换为bcrypt哈希并更新数据库
-        if password_valid:
-            hashed_password = bcrypt.hashpw(data.get('password').encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            user.password = hashed_password
+        password_valid, new_hash = check_password_bounded(
+            data['password'],
+            user.password,
+            rounds=current_app.config['BCRYPT_ROUNDS'],
+            max_workers=current_app.config['LOGIN_HASH_WORKERS'],
+            queue_depth=current_app.config['LOGIN_HASH_QUEUE_DEPTH'],
+            timeout=current_app.config['LOGIN_HASH_TIMEOUT']
+        )
+    except (PasswordPoolBusy, FutureTimeoutError):
+        login_latency.record(login_latency.time() - start, 'busy')
+        return jsonify({'error': 'Login service busy, please retry'}), 503, {'Retry-After': '1'}
+
+    # 明文密码或cost变更时，写回新的bcrypt哈希
+    if new_hash:
+        try:
+            user.password = new_hash
             db.session.commit()
-    
+        except Exception as e:
+            db.session.rollback()
+            print(f"Rehash password error: {e}")
+
+    login_latency.record(login_latency.time() - start, 'ok' if password_valid else 'invalid')
+
     if not password_valid:
         return jsonify({'error': 'Invalid credentials'}), 401
 
+    # 签发令牌，后续请求可直接从claims中读取身份与角色
+    token, expires_at = issue_token(user)
+
     return jsonify({
         'success': True,
-        'user': user.to_dict()
+        'user': user.to_dict(),
+        'token': token,
+        'expiresAt': expires_at
     })
 
+@api_bp.route('/metrics', methods=['GET'])
+@auth_required('ADMIN')
+def get_metrics():
+    """获取进程内运行指标（登录耗时等）"""
+    return jsonify(metrics.snapshot_all())
+
 # Material Routes
+# 材料列表可选字段，与 Material.to_dict 的键一致
+MATERIAL_FIELDS = ['id', 'title', 'author', 'type', 'content', 'coverUrl', 'coverThumbUrl', 'assignedToUserIds',
+                   'assignedCount', 'readCount', 'created_at', 'updated_at']
+# 摘要视图：不含正文及分配用户列表
+MATERIAL_SUMMARY_FIELDS = [f for f in MATERIAL_FIELDS if f not in ('content', 'assignedToUserIds')]
+
+def _parse_material_fields():
+    """解析 ?fields= 或 ?view=summary，返回需要输出的字段列表"""
+    fields = request.args.get('fields')
+    if fields:
+        selected = [f.strip() for f in fields.split(',') if f.strip() in MATERIAL_FIELDS]
+        return selected or ['id']
+    if request.args.get('view') == 'summary':
+        return MATERIAL_SUMMARY_FIELDS
+    return MATERIAL_FIELDS
+
+def _material_user_ids(material_ids):
+    """一次查询获取材料被分配的用户ID列表"""
+    result = {}
+    rows = db.session.query(MaterialAssignment.material_id, MaterialAssignment.user_id) \
+        .filter(MaterialAssignment.material_id.in_(material_ids)).all()
+    for material_id, user_id in rows:
+        result.setdefault(material_id, []).append(user_id)
+    return result
+
+def _project_material(material, fields, user_ids):
+    """按字段列表投影材料，避免访问未加载的正文和分配关系"""
+    values = {
+        'id': lambda: material.id,
+        'title': lambda: material.title,
+        'author': lambda: material.author,
+        'type': lambda: material.type,
+        'content': lambda: material.content,
+        'coverUrl': lambda: material.cover_url,
+        'coverThumbUrl': lambda: covers.thumb_url(material.id, material.cover_url),
+        'assignedToUserIds': lambda: user_ids.get(material.id, []),
+        'assignedCount': lambda: material.assigned_count,
+        'readCount': lambda: material.read_count,
+        'created_at': lambda: material.created_at.isoformat(),
+        'updated_at': lambda: material.updated_at.isoformat()
+    }
+    return {field: values[field]() for field in fields}
+
 @api_bp.route('/materials', methods=['GET'])
 def get_materials():
-    """获取所有材料"""
-    materials = Material.query.all()
-    return jsonify([material.to_dict() for material in materials])
+    """获取材料列表，支持 ?view=summary、?fields= 字段选择与游标分页(limit/cursor)"""
+    fields = _parse_material_fields()
+    limit, cursor = _parse_page_args()
+
+    # 条件请求：材料表与分配表均未变化时直接返回304
+    material_count, last_modified = _table_version(Material)
+    etag = make_etag('materials', request.query_string.decode(), material_count, last_modified, *_assignment_version())
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    query = Material.query
+    # 未请求正文时延迟加载 content 列
+    if 'content' not in fields:
+        query = query.options(db.defer(Material.content))
+    query = query.order_by(Material.id)
+
+    if limit is not None:
+        if cursor:
+            query = query.filter(Material.id > cursor)
+        materials = query.limit(limit + 1).all()
+        has_more = len(materials) > limit
+        materials = materials[:limit]
+    else:
+        materials = query.all()
+
+    material_ids = [m.id for m in materials]
+    user_ids = _material_user_ids(material_ids) if material_ids and 'assignedToUserIds' in fields else {}
+    items = [_project_material(m, fields, user_ids) for m in materials]
+
+    # 未携带分页参数时保持原有的数组返回格式
+    if limit is None:
+        return with_validators(jsonify(items), etag, last_modified)
+    response = jsonify({
+        'items': items,
+        'nextCursor': materials[-1].id if has_more else None,
+        'hasMore': has_more
+    })
+    return with_validators(response, etag, last_modified)
+
+@api_bp.route('/materials/search', methods=['GET'])
+def search_materials():
+    """全文检索材料（标题、作者、正文），按相关度排序，支持 limit/offset 分页"""
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({'error': 'Missing query parameter: q'}), 400
+
+    limit = min(request.args.get('limit', type=int) or current_app.config['DEFAULT_PAGE_SIZE'],
+                current_app.config['MAX_PAGE_SIZE'])
+    offset = max(request.args.get('offset', type=int) or 0, 0)
+
+    terms = query_terms(q)
+    if not terms:
+        return jsonify({'items': [], 'total': 0, 'limit': limit, 'offset': offset})
+
+    # 在倒排索引上按材料聚合：必须命中全部词条，得分为权重之和
+    matches = db.session.query(
+        MaterialTerm.material_id.label('material_id'),
+        db.func.sum(MaterialTerm.weight).label('score')
+    ).filter(MaterialTerm.term.in_(terms)) \
+        .group_by(MaterialTerm.material_id) \
+        .having(db.func.count(MaterialTerm.id) == len(terms)).subquery()
+
+    total = db.session.query(db.func.count()).select_from(matches).scalar()
+    rows = db.session.query(
+        Material.id, Material.title, Material.author, Material.type, Material.cover_url, matches.c.score
+    ).join(matches, matches.c.material_id == Material.id) \
+        .order_by(matches.c.score.desc(), Material.id) \
+        .limit(limit).offset(offset).all()
+
+    return jsonify({
+        'items': [{
+            'id': row.id,
+            'title': row.title,
+            'author': row.author,
+            'type': row.type,
+            'coverUrl': row.cover_url,
+            'coverThumbUrl': covers.thumb_url(row.id, row.cover_url),
+            'score': round(float(row.score), 4)
+        } for row in rows],
+        'total': total,
+        'limit': limit,
+        'offset': offset
+    })
 
 @api_bp.route('/materials/<string:id>', methods=['GET'])
 def get_material(id):
     """获取单个材料"""
-    material = Material.query.get(id)
-    if not material:
+    # 先只查询版本字段，命中缓存时无需加载正文
+    version = db.session.query(Material.updated_at).filter(Material.id == id).first()
+    if not version:
         return jsonify({'error': 'Material not found'}), 404
-    return jsonify(material.to_dict())
+
+    etag = make_etag('material', id, version.updated_at, *_assignment_version(MaterialAssignment.material_id == id))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    material = Material.query.get(id)
+    return with_validators(jsonify(material.to_dict()), etag, material.updated_at)
 
 @api_bp.route('/materials', methods=['POST'])
+@auth_required('ADMIN')
 def create_material():
     """创建材料"""
     data = request.get_json()
@@ -279,13 +698,18 @@ def create_material():
 
     try:
         db.session.add(new_material)
+        db.session.flush()
+        _rebuild_segments(new_material)
+        reindex_material(new_material)
         db.session.commit()
+        _schedule_cover(new_material.cover_url)
         return jsonify(new_material.to_dict()), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/materials/<string:id>', methods=['PUT'])
+@auth_required('ADMIN')
 def update_material(id):
     """更新材料"""
     material = Material.query.get(id)
@@ -305,17 +729,60 @@ def update_material(id):
         material.type = data['type']
     if 'content' in data:
         material.content = data['content']
+    cover_changed = 'coverUrl' in data and data['coverUrl'] != material.cover_url
     if 'coverUrl' in data:
         material.cover_url = data['coverUrl']
 
     try:
+        # 正文或类型变化时重新分段
+        if 'content' in data or 'type' in data:
+            _rebuild_segments(material)
+        # 检索相关字段变化时更新倒排索引
+        if any(field in data for field in ('title', 'author', 'type', 'content')):
+            reindex_material(material)
         db.session.commit()
+        # 封面地址变化时为新地址生成缩略图，旧缩略图由 gc-uploads 清理
+        if cover_changed:
+            _schedule_cover(material.cover_url)
         return jsonify(material.to_dict())
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def _schedule_cover(url):
+    """在后台为封面生成缩略图"""
+    config = current_app.config
+    covers.schedule(url, config['COVER_THUMB_WIDTHS'], config['COVER_MAX_SOURCE_SIZE'], config['COVER_FETCH_TIMEOUT'])
+
+@api_bp.route('/materials/<string:id>/cover/<string:key>', methods=['GET'])
+def get_material_cover(id, key):
+    """提供封面缩略图，?w= 选择宽度，按 Accept 选择WebP或JPEG
+
+    地址中的key由封面地址计算，须与材料当前封面一致；内容不可变，可永久缓存；缩略图尚未生成时临时重定向到原图。
+    """
+    width = covers.pick_width(request.args.get('w', type=int), current_app.config['COVER_THUMB_WIDTHS'])
+    # 只有明确声明支持WebP时才返回WebP，*/* 或 image/* 不算
+    accepts_webp = any(mimetype == 'image/webp' and quality > 0 for mimetype, quality in request.accept_mimetypes)
+    ext = 'webp' if accepts_webp else 'jpg'
+
+    # key必须与该材料当前的封面地址对应，否则任意已生成的缩略图都能挂在任意材料下被长期缓存
+    material = db.session.get(Material, id, options=[db.defer(Material.content)])
+    if not material or not material.cover_url or covers.cover_key(material.cover_url) != key:
+        return jsonify({'error': 'Cover not found'}), 404
+
+    if covers.status(key) == 'ready':
+        response = send_from_directory(covers.cover_dir(key), f'{width}.{ext}', mimetype=covers.FORMATS[ext][1])
+        response.headers['Cache-Control'] = f"public, max-age={current_app.config['IMMUTABLE_MAX_AGE']}, immutable"
+        response.vary.add('Accept')
+        return response
+
+    _schedule_cover(material.cover_url)
+    response = redirect(material.cover_url)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @api_bp.route('/materials/<string:id>', methods=['DELETE'])
+@auth_required('ADMIN')
 def delete_material(id):
     """删除材料"""
     material = Material.query.get(id)
@@ -325,12 +792,16 @@ def delete_material(id):
     try:
         # 删除相关分配
         MaterialAssignment.query.filter_by(material_id=id).delete()
-        # 删除相关日志
+        # 删除相关日志及阅读会话
         Log.query.filter_by(material_id=id).delete()
+        ReadingSession.query.filter_by(material_id=id).delete()
         # 删除相关表单配置
         MaterialFormConfig.query.filter_by(material_id=id).delete()
         # 删除相关用户答卷
         UserResponse.query.filter_by(material_id=id).delete()
+        # 删除分段与检索索引
+        MaterialSegment.query.filter_by(material_id=id).delete()
+        MaterialTerm.query.filter_by(material_id=id).delete()
         
         db.session.delete(material)
         db.session.commit()
@@ -339,46 +810,175 @@ def delete_material(id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def _rebuild_segments(material):
+    """重新生成材料分段，在调用方的事务中执行"""
+    MaterialSegment.query.filter_by(material_id=material.id).delete()
+    segments = build_segments(material.type, material.content, current_app.config['SEGMENT_TARGET_CHARS'])
+    if segments:
+        db.session.execute(MaterialSegment.__table__.insert(), [{
+            'material_id': material.id,
+            'seq': seg['seq'],
+            'start_offset': seg['start'],
+            'end_offset': seg['end'],
+            'heading': seg['heading'],
+            'content': seg['content'],
+            'checksum': seg['checksum']
+        } for seg in segments])
+    return len(segments)
+
+def _ensure_segments(material_id):
+    """历史材料尚未分段时按需生成，返回是否存在分段"""
+    if db.session.query(MaterialSegment.id).filter_by(material_id=material_id).first():
+        return True
+    material = Material.query.get(material_id)
+    try:
+        count = _rebuild_segments(material)
+        db.session.commit()
+        return count > 0
+    except Exception as e:
+        db.session.rollback()
+        print(f"Build segments error: {e}")
+        return False
+
+@api_bp.route('/materials/<string:id>/segments', methods=['GET'])
+def get_material_segments(id):
+    """获取材料分段清单（不含正文）"""
+    material = db.session.query(Material.type, Material.updated_at).filter(Material.id == id).first()
+    if not material:
+        return jsonify({'error': 'Material not found'}), 404
+    if material.type not in SEGMENTED_TYPES:
+        return jsonify({'error': 'Segments are only available for TEXT/HTML materials'}), 400
+
+    etag = make_etag('segments', id, material.updated_at)
+    cached = not_modified(etag, material.updated_at)
+    if cached:
+        return cached
+
+    _ensure_segments(id)
+    segments = MaterialSegment.query.options(db.defer(MaterialSegment.content)) \
+        .filter_by(material_id=id).order_by(MaterialSegment.seq).all()
+
+    response = jsonify({
+        'materialId': id,
+        'type': material.type,
+        'count': len(segments),
+        'totalLength': segments[-1].end_offset if segments else 0,
+        'segments': [seg.to_dict(include_content=False) for seg in segments]
+    })
+    return with_validators(response, etag, material.updated_at)
+
+@api_bp.route('/materials/<string:id>/segments/<int:seq>', methods=['GET'])
+def get_material_segment(id, seq):
+    """获取材料的单个分段"""
+    segment = MaterialSegment.query.filter_by(material_id=id, seq=seq).first()
+    if not segment and seq == 0 and _ensure_segments(id):
+        segment = MaterialSegment.query.filter_by(material_id=id, seq=seq).first()
+    if not segment:
+        return jsonify({'error': 'Segment not found'}), 404
+
+    cached = not_modified(segment.checksum)
+    if cached:
+        return cached
+    return with_validators(jsonify(segment.to_dict()), segment.checksum)
+
+def _is_string_list(value):
+    """userIds/materialIds 必须是字符串数组"""
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+def _bulk_assign(material_ids, user_ids=None, group=None):
+    """集合式批量分配，返回 (候选分配数, 实际插入数)
+
+    用单条 INSERT IGNORE ... SELECT 写入材料与用户的笛卡尔积，
+    已存在的组合由唯一约束 _material_user_uc 跳过，不存在的用户和材料自然不会被选中。
+    调用方负责提交事务。
+    """
+    user_filter = User.phone_number.in_(user_ids) if user_ids is not None else User.group == group
+    candidates = db.select(
+        Material.id,
+        User.phone_number,
+        db.literal(datetime.now(beijing_tz)),
+        db.literal(False)
+    ).select_from(Material).join(User, db.true()).where(Material.id.in_(material_ids), user_filter)
+
+    total = db.session.query(db.func.count()).select_from(candidates.subquery()).scalar()
+    stmt = db.insert(MaterialAssignment) \
+        .prefix_with('IGNORE', dialect='mysql') \
+        .prefix_with('OR IGNORE', dialect='sqlite') \
+        .from_select(['material_id', 'user_id', 'assigned_at', 'read_status'], candidates)
+    inserted = db.session.execute(stmt).rowcount if total else 0
+
+    if inserted:
+        refresh_material_counters(material_ids)
+    return total, inserted
+
 @api_bp.route('/materials/<string:id>/assign', methods=['POST'])
+@auth_required('ADMIN')
 def assign_material(id):
     """分配材料给用户"""
     data = request.get_json()
-    if not data or 'userIds' not in data:
+    if not isinstance(data, dict) or 'userIds' not in data:
         return jsonify({'error': 'Missing userIds field'}), 400
+    if not _is_string_list(data['userIds']):
+        return jsonify({'error': 'userIds must be a list of strings'}), 400
 
     material = Material.query.get(id)
     if not material:
         return jsonify({'error': 'Material not found'}), 404
 
     try:
-        for user_id in data['userIds']:
-            # 检查用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                continue
-            
-            # 检查是否已分配
-            existing_assignment = MaterialAssignment.query.filter_by(
-                material_id=id, user_id=user_id
-            ).first()
-            if not existing_assignment:
-                assignment = MaterialAssignment(material_id=id, user_id=user_id)
-                db.session.add(assignment)
-        
+        _bulk_assign([id], user_ids=data['userIds'])
         db.session.commit()
         return jsonify(material.to_dict())
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/materials/bulk-assign', methods=['POST'])
+@auth_required('ADMIN')
+def bulk_assign_materials():
+    """批量分配：多个材料 × 用户列表(userIds)或分组(group)"""
+    data = request.get_json()
+    if not isinstance(data, dict) or not data.get('materialIds'):
+        return jsonify({'error': 'Missing materialIds field'}), 400
+    if not _is_string_list(data['materialIds']):
+        return jsonify({'error': 'materialIds must be a list of strings'}), 400
+    if 'userIds' in data:
+        if not _is_string_list(data['userIds']):
+            return jsonify({'error': 'userIds must be a list of strings'}), 400
+    elif not isinstance(data.get('group'), str) or not data['group']:
+        return jsonify({'error': 'Missing userIds or group field'}), 400
+
+    material_ids = list(dict.fromkeys(data['materialIds']))
+    found_ids = {row[0] for row in db.session.query(Material.id).filter(Material.id.in_(material_ids)).all()}
+
+    try:
+        total, inserted = _bulk_assign(
+            list(found_ids),
+            user_ids=data.get('userIds'),
+            group=None if 'userIds' in data else data['group']
+        ) if found_ids else (0, 0)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'success': True,
+        'inserted': inserted,
+        'skipped': total - inserted,
+        'missingMaterialIds': [m for m in material_ids if m not in found_ids]
+    })
+
 @api_bp.route('/materials/<string:id>/unassign/<string:userId>', methods=['DELETE'])
+@auth_required('ADMIN')
 def unassign_material(id, userId):
     """取消分配材料"""
     try:
         assignment = MaterialAssignment.query.filter_by(
             material_id=id, user_id=userId
-        ).first()
+        ).with_for_update().first()
         if assignment:
+            adjust_material_counters(id, assigned_delta=-1, read_delta=-1 if assignment.read_status else 0)
             db.session.delete(assignment)
             db.session.commit()
             return jsonify({'success': True})
@@ -388,69 +988,115 @@ def unassign_material(id, userId):
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/materials/<string:id>/mark-read/<string:userId>', methods=['PUT'])
+@auth_required('ADMIN', self_param='userId')
 def mark_material_read(id, userId):
     """标记材料为已阅读"""
     try:
-        assignment = MaterialAssignment.query.filter_by(
-            material_id=id, user_id=userId
-        ).first()
+        # 条件更新：只有状态真正变化时才调整计数，并发请求也只计一次
+        changed = MaterialAssignment.query.filter_by(
+            material_id=id, user_id=userId, read_status=False
+        ).update({MaterialAssignment.read_status: True}, synchronize_session=False)
         
-        if not assignment:
+        if changed:
+            adjust_material_counters(id, read_delta=changed)
+        elif not MaterialAssignment.query.filter_by(material_id=id, user_id=userId).first():
             # If assignment doesn't exist, create it (auto-assign on read)
-            assignment = MaterialAssignment(material_id=id, user_id=userId)
-            db.session.add(assignment)
+            db.session.add(MaterialAssignment(material_id=id, user_id=userId, read_status=True))
+            adjust_material_counters(id, assigned_delta=1, read_delta=1)
             
-        assignment.read_status = True
         db.session.commit()
-        return jsonify({'success': True, 'readStatus': assignment.read_status})
+        return jsonify({'success': True, 'readStatus': True})
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/materials/<string:id>/mark-unread/<string:userId>', methods=['PUT'])
+@auth_required('ADMIN', self_param='userId')
 def mark_material_unread(id, userId):
     """标记材料为未阅读"""
     try:
-        assignment = MaterialAssignment.query.filter_by(
-            material_id=id, user_id=userId
-        ).first()
-        if assignment:
-            assignment.read_status = False
+        changed = MaterialAssignment.query.filter_by(
+            material_id=id, user_id=userId, read_status=True
+        ).update({MaterialAssignment.read_status: False}, synchronize_session=False)
+        if changed:
+            adjust_material_counters(id, read_delta=-changed)
             db.session.commit()
-            return jsonify({'success': True, 'readStatus': assignment.read_status})
+            return jsonify({'success': True, 'readStatus': False})
+        if MaterialAssignment.query.filter_by(material_id=id, user_id=userId).first():
+            return jsonify({'success': True, 'readStatus': False})
         return jsonify({'error': 'Assignment not found'}), 404
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/users/<string:userId>/materials', methods=['GET'])
+@auth_required('ADMIN', self_param='userId')
 def get_user_materials(userId):
-    """获取用户分配的材料"""
-    user = User.query.get(userId)
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
-    
-    # 返回包含阅读状态的材料列表
+    """获取用户分配的材料（含阅读状态），支持 ?view=summary 省略正文"""
+    columns = [Material.id, Material.title, Material.author, Material.type, Material.cover_url,
+               Material.assigned_count, Material.read_count, Material.created_at, Material.updated_at,
+               MaterialAssignment.read_status]
+    include_content = request.args.get('view') != 'summary'
+    if include_content:
+        columns.append(Material.content)
+
+    # 单次联表查询，只取阅读列表需要的列
+    rows = db.session.query(*columns) \
+        .join(MaterialAssignment, MaterialAssignment.material_id == Material.id) \
+        .filter(MaterialAssignment.user_id == userId) \
+        .order_by(MaterialAssignment.id).all()
+
+    # 没有分配记录时再确认用户是否存在；令牌已证明用户存在时跳过
+    if not rows:
+        claims = get_current_claims()
+        if not (claims and claims['sub'] == userId) and not db.session.query(User.phone_number).filter_by(phone_number=userId).first():
+            return jsonify({'error': 'User not found'}), 404
+
+    # 前端阅读列表按 assignedToUserIds 过滤，分配用户一次批量查询取回
+    user_ids = _material_user_ids([row.id for row in rows]) if rows and include_content else {}
     materials = []
-    for assignment in user.assigned_materials:
-        material_dict = assignment.material.to_dict()
-        material_dict['readStatus'] = assignment.read_status
+    for row in rows:
+        material_dict = {
+            'id': row.id,
+            'title': row.title,
+            'author': row.author,
+            'type': row.type,
+            'coverUrl': row.cover_url,
+            'coverThumbUrl': covers.thumb_url(row.id, row.cover_url),
+            'assignedCount': row.assigned_count,
+            'readCount': row.read_count,
+            'readStatus': row.read_status,
+            'created_at': row.created_at.isoformat(),
+            'updated_at': row.updated_at.isoformat()
+        }
+        if include_content:
+            material_dict['content'] = row.content
+            material_dict['assignedToUserIds'] = user_ids.get(row.id, [])
         materials.append(material_dict)
     return jsonify(materials)
 
 # Log Routes
 @api_bp.route('/logs', methods=['POST'])
+@auth_required()
 def create_log():
     """创建操作日志"""
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No data provided'}), 400
 
+    # 携带令牌时可省略userId，直接使用令牌中的身份
+    claims = get_current_claims()
+    if 'userId' not in data and claims:
+        data['userId'] = claims['sub']
+
     # 检查必填字段
     required_fields = ['userId', 'action']
     for field in required_fields:
         if field not in data:
             return jsonify({'error': f'Missing required field: {field}'}), 400
+    forbidden = forbid_other_user(data['userId'])
+    if forbidden:
+        return forbidden
 
     # 获取IP地址
     if request.headers.getlist("X-Forwarded-For"):
@@ -469,56 +1115,310 @@ def create_log():
         'userAgent': user_agent
     }
 
+    # 事件时间在接收时确定，写后缓冲延迟入库不影响时间顺序
+    row = {
+        'user_id': data['userId'],
+        'action': data['action'],
+        'material_id': data.get('materialId'),
+        'details': json.dumps(details_json, ensure_ascii=False),
+        'created_at': datetime.now(beijing_tz),
+        # 常用字段同时写入独立列，便于在SQL中过滤统计
+        **structured_fields(data['action'], details_content, ip_address, user_agent, data.get('queryType'))
+    }
+
+    # 写后缓冲：入队即返回，由后台线程批量写入
+    buffer = current_app.extensions.get('log_buffer')
+    if buffer is not None:
+        try:
+            buffer.submit(row)
+            return jsonify({
+                'queued': True,
+                'userId': row['user_id'],
+                'action': row['action'],
+                'materialId': row['material_id'],
+                'details': row['details'],
+                'ip': row['ip'],
+                'userAgent': row['user_agent'],
+                'contentLength': row['content_length'],
+                'aiQueryType': row['ai_query_type'],
+                'createdAt': row['created_at'].isoformat()
+            }), 202
+        except log_buffer.BufferFull:
+            if buffer.policy == log_buffer.POLICY_REJECT:
+                return jsonify({'error': 'Log buffer is full, please retry'}), 503, {'Retry-After': '1'}
+            # sync 策略：缓冲已满时退回同步写入
+
     # 创建新日志
-    new_log = Log(
-        user_id=data['userId'],
-        action=data['action'],
-        material_id=data.get('materialId'),
-        details=json.dumps(details_json, ensure_ascii=False)
-    )
+    new_log = Log(**row)
 
     try:
         db.session.add(new_log)
+        # 打开/关闭材料事件同时更新阅读会话汇总
+        reading_sessions.apply_rows([row], current_app.config['READING_SESSION_TIMEOUT'])
         db.session.commit()
         return jsonify(new_log.to_dict()), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def _parse_time_arg(name):
+    """解析ISO格式的时间参数，带时区时换算为北京时间（数据库中按北京时间存储）"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(beijing_tz).replace(tzinfo=None)
+    return parsed
+
+def _log_filter_conditions():
+    """解析日志过滤参数 ?action=（可逗号分隔）、?ip=、?aiQueryType=、?since=/?until=，时间格式无效时抛出 ValueError"""
+    conditions = []
+    since = _parse_time_arg('since')
+    until = _parse_time_arg('until')
+
+    actions = [a.strip() for a in request.args.get('action', '').split(',') if a.strip()]
+    if len(actions) == 1:
+        conditions.append(Log.action == actions[0])
+    elif actions:
+        conditions.append(Log.action.in_(actions))
+    if request.args.get('ip'):
+        conditions.append(Log.ip == request.args['ip'])
+    if request.args.get('aiQueryType'):
+        conditions.append(Log.ai_query_type == request.args['aiQueryType'])
+    if since:
+        conditions.append(Log.created_at >= since)
+    if until:
+        conditions.append(Log.created_at < until)
+    return conditions
+
+# 日志列表与导出输出的列
+LOG_COLUMNS = [Log.id, Log.user_id, Log.action, Log.material_id, Log.details, Log.ip, Log.user_agent,
+               Log.content_length, Log.ai_query_type, Log.created_at]
+
+def _log_row_dict(row):
+    """将查询行转换为与 Log.to_dict 一致的字典"""
+    return {
+        'id': row.id,
+        'userId': row.user_id,
+        'action': row.action,
+        'materialId': row.material_id,
+        'details': row.details,
+        'ip': row.ip,
+        'userAgent': row.user_agent,
+        'contentLength': row.content_length,
+        'aiQueryType': row.ai_query_type,
+        'createdAt': row.created_at.isoformat()
+    }
+
+def _log_page(conditions):
+    """按条件查询日志，支持过滤参数（见 _log_filter_conditions）及游标分页
+
+    按 (created_at, id) 倒序做键集分页，配合 (user_id/material_id/action, created_at) 复合索引
+    及无过滤时的 (created_at, id) 索引，避免全表扫描和文件排序。未携带分页参数时保持原有的数组返回格式。
+    """
+    try:
+        conditions = conditions + _log_filter_conditions()
+    except ValueError:
+        return jsonify({'error': 'Invalid time range'}), 400
+
+    limit, cursor = _parse_page_args()
+    if cursor:
+        try:
+            cursor_time, cursor_id = cursor.rsplit(',', 1)
+            cursor_time, cursor_id = datetime.fromisoformat(cursor_time), int(cursor_id)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        conditions.append(db.or_(
+            Log.created_at < cursor_time,
+            db.and_(Log.created_at == cursor_time, Log.id < cursor_id)
+        ))
+
+    # 只查询需要的列，不构造ORM对象
+    query = db.select(*LOG_COLUMNS).where(*conditions).order_by(Log.created_at.desc(), Log.id.desc())
+    if limit is not None:
+        query = query.limit(limit + 1)
+    rows = db.session.execute(query).all()
+
+    has_more = limit is not None and len(rows) > limit
+    if has_more:
+        rows = rows[:limit]
+    items = [_log_row_dict(row) for row in rows]
+
+    if limit is None:
+        return jsonify(items)
+    return jsonify({
+        'items': items,
+        'nextCursor': f'{rows[-1].created_at.isoformat()},{rows[-1].id}' if has_more else None,
+        'hasMore': has_more
+    })
+
 @api_bp.route('/logs', methods=['GET'])
+@auth_required('ADMIN')
 def get_logs():
-    """获取所有日志"""
-    logs = Log.query.order_by(Log.created_at.desc()).all()
-    return jsonify([log.to_dict() for log in logs])
+    """获取日志，可按 ?userId=、?materialId= 过滤"""
+    conditions = []
+    if request.args.get('userId'):
+        conditions.append(Log.user_id == request.args['userId'])
+    if request.args.get('materialId'):
+        conditions.append(Log.material_id == request.args['materialId'])
+    return _log_page(conditions)
+
+# 导出CSV的表头，与 _log_row_dict 的键一致
+LOG_EXPORT_FIELDS = ['id', 'userId', 'action', 'materialId', 'ip', 'userAgent', 'contentLength', 'aiQueryType',
+                     'details', 'createdAt']
+
+@api_bp.route('/logs/export', methods=['GET'])
+@auth_required('ADMIN')
+def export_logs():
+    """流式导出日志：?format=ndjson|csv，?gzip=1 输出gz文件
+
+    过滤参数与日志列表相同，另支持 ?userId=、?materialId=。查询使用服务端游标分批读取，
+    逐批编码输出，内存占用与导出规模无关。
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Unsupported format'}), 400
+    try:
+        conditions = _log_filter_conditions()
+    except ValueError:
+        return jsonify({'error': 'Invalid time range'}), 400
+    if request.args.get('userId'):
+        conditions.append(Log.user_id == request.args['userId'])
+    if request.args.get('materialId'):
+        conditions.append(Log.material_id == request.args['materialId'])
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    batch_size = current_app.config['LOG_EXPORT_BATCH_SIZE']
+    query = db.select(*LOG_COLUMNS).where(*conditions).order_by(Log.created_at, Log.id) \
+        .execution_options(yield_per=batch_size)
+    gzip_level = current_app.config['COMPRESS_GZIP_LEVEL']
+
+    def encode_batches():
+        result = db.session.execute(query)
+        try:
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.DictWriter(buffer, fieldnames=LOG_EXPORT_FIELDS)
+                # 带BOM以便Excel正确识别中文
+                yield '\ufeff' + ','.join(LOG_EXPORT_FIELDS) + '\r\n'
+                for rows in result.partitions():
+                    writer.writerows(_log_row_dict(row) for row in rows)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate(0)
+            else:
+                for rows in result.partitions():
+                    yield ''.join(json.dumps(_log_row_dict(row), ensure_ascii=False) + '\n' for row in rows)
+        finally:
+            result.close()
+
+    def generate():
+        if not use_gzip:
+            for chunk in encode_batches():
+                yield chunk.encode('utf-8')
+            return
+        compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+        for chunk in encode_batches():
+            data = compressor.compress(chunk.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+
+    filename = f"logs-{datetime.now(beijing_tz):%Y%m%d-%H%M%S}.{export_format}"
+    if use_gzip:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    # 关闭反向代理缓冲，边查询边输出
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @api_bp.route('/logs/user/<string:userId>', methods=['GET'])
+@auth_required('ADMIN', self_param='userId')
 def get_user_logs(userId):
     """获取特定用户的日志"""
-    logs = Log.query.filter_by(user_id=userId).order_by(Log.created_at.desc()).all()
-    return jsonify([log.to_dict() for log in logs])
+    return _log_page([Log.user_id == userId])
 
 @api_bp.route('/logs/material/<string:materialId>', methods=['GET'])
+@auth_required('ADMIN')
 def get_material_logs(materialId):
     """获取特定材料的日志"""
-    logs = Log.query.filter_by(material_id=materialId).order_by(Log.created_at.desc()).all()
-    return jsonify([log.to_dict() for log in logs])
+    return _log_page([Log.material_id == materialId])
+
+# Reading Session Routes
+@api_bp.route('/reading-sessions/totals', methods=['GET'])
+@auth_required('ADMIN')
+def get_reading_session_totals():
+    """阅读时长汇总：?by=user|material|group，可按 ?userId=、?materialId=、?group=、?since=/?until= 过滤"""
+    by = request.args.get('by', 'user')
+    if by not in ('user', 'material', 'group'):
+        return jsonify({'error': 'Invalid grouping'}), 400
+    try:
+        since = _parse_time_arg('since')
+        until = _parse_time_arg('until')
+    except ValueError:
+        return jsonify({'error': 'Invalid time range'}), 400
+
+    try:
+        rows = reading_sessions.totals(
+            by, current_app.config['READING_SESSION_TIMEOUT'],
+            user_id=request.args.get('userId'),
+            material_id=request.args.get('materialId'),
+            group=request.args.get('group'),
+            since=since,
+            until=until
+        )
+    except Exception as e:
+        db.session.rollback()
+        print(f"Reading session totals error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    key_name = {'user': 'userId', 'material': 'materialId', 'group': 'group'}[by]
+    return jsonify([{
+        key_name: row.key,
+        'sessions': int(row.sessions or 0),
+        'totalSeconds': int(row.total_seconds or 0),
+        'avgSeconds': round(row.total_seconds / row.sessions, 1) if row.sessions else 0,
+        'timedOut': int(row.timed_out or 0),
+        'users': row.users
+    } for row in rows])
 
 # Form Routes
 @api_bp.route('/forms', methods=['GET'])
 def get_forms():
     """获取所有表单"""
+    form_count, last_modified = _table_version(Form)
+    etag = make_etag('forms', form_count, last_modified)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
     forms = Form.query.all()
-    return jsonify([form.to_dict() for form in forms])
+    return with_validators(jsonify([form.to_dict() for form in forms]), etag, last_modified)
 
 @api_bp.route('/forms/<string:id>', methods=['GET'])
 def get_form(id):
     """获取单个表单"""
-    form = Form.query.get(id)
-    if not form:
+    version = db.session.query(Form.updated_at).filter(Form.id == id).first()
+    if not version:
         return jsonify({'error': 'Form not found'}), 404
-    return jsonify(form.to_dict())
+
+    etag = make_etag('form', id, version.updated_at)
+    cached = not_modified(etag, version.updated_at)
+    if cached:
+        return cached
+
+    form = Form.query.get(id)
+    return with_validators(jsonify(form.to_dict()), etag, form.updated_at)
 
 @api_bp.route('/forms', methods=['POST'])
+@auth_required('ADMIN')
 def create_form():
     """创建表单"""
     data = request.get_json()
@@ -554,6 +1454,7 @@ def create_form():
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/forms/<string:id>', methods=['PUT'])
+@auth_required('ADMIN')
 def update_form(id):
     """更新表单"""
     form = Form.query.get(id)
@@ -582,6 +1483,7 @@ def update_form(id):
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/forms/<string:id>', methods=['DELETE'])
+@auth_required('ADMIN')
 def delete_form(id):
     """删除表单"""
     form = Form.query.get(id)
@@ -597,6 +1499,7 @@ def delete_form(id):
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/users/<string:phone_number>/consent', methods=['PUT'])
+@auth_required('ADMIN', self_param='phone_number')
 def update_consent(phone_number):
     """更新用户的知情同意状态"""
     user = User.query.get(phone_number)
@@ -619,6 +1522,7 @@ def update_consent(phone_number):
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/users/<string:phone_number>/reset-experiment', methods=['POST'])
+@auth_required('ADMIN')
 def reset_experiment(phone_number):
     """重置用户的实验状态"""
     user = User.query.get(phone_number)
@@ -626,12 +1530,14 @@ def reset_experiment(phone_number):
         return jsonify({'error': 'User not found'}), 404
 
     try:
-        # 1. 删除材料分配记录
+        # 1. 删除材料分配记录（先扣减材料计数）
+        release_user_assignments(phone_number)
         MaterialAssignment.query.filter_by(user_id=phone_number).delete()
         # 2. 删除用户答卷记录
         UserResponse.query.filter_by(user_id=phone_number).delete()
-        # 3. 删除相关日志记录
+        # 3. 删除相关日志记录及阅读会话
         Log.query.filter_by(user_id=phone_number).delete()
+        ReadingSession.query.filter_by(user_id=phone_number).delete()
         
         db.session.commit()
         return jsonify({'success': True, 'message': '实验状态已重置'})
@@ -642,6 +1548,7 @@ def reset_experiment(phone_number):
 
 # Material-Form Config Routes
 @api_bp.route('/material-form-configs', methods=['POST'])
+@auth_required('ADMIN')
 def create_material_form_config():
     """创建材料与表单的关联"""
     data = request.get_json()
@@ -689,6 +1596,7 @@ def get_material_forms(materialId):
     return jsonify(result)
 
 @api_bp.route('/material-form-configs/<int:id>', methods=['DELETE'])
+@auth_required('ADMIN')
 def delete_material_form_config(id):
     """删除关联"""
     config = MaterialFormConfig.query.get(id)
@@ -705,6 +1613,7 @@ def delete_material_form_config(id):
 
 # User Response Routes
 @api_bp.route('/user-responses', methods=['POST'])
+@auth_required()
 def create_user_response():
     """提交用户答卷"""
     data = request.get_json()
@@ -715,6 +1624,9 @@ def create_user_response():
     for field in required_fields:
         if field not in data:
             return jsonify({'error': f'Missing required field: {field}'}), 400
+    forbidden = forbid_other_user(data['userId'])
+    if forbidden:
+        return forbidden
 
     # 计算最小可用ID (Gap-Filling)
     existing_ids = sorted([r[0] for r in db.session.query(UserResponse.id).all()])
@@ -743,12 +1655,14 @@ def create_user_response():
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/user-responses/user/<string:userId>', methods=['GET'])
+@auth_required('ADMIN', self_param='userId')
 def get_user_responses(userId):
     """获取用户的答卷记录"""
     responses = UserResponse.query.filter_by(user_id=userId).order_by(UserResponse.created_at.desc()).all()
     return jsonify([resp.to_dict() for resp in responses])
 
 @api_bp.route('/user-responses/material/<string:materialId>', methods=['GET'])
+@auth_required('ADMIN')
 def get_material_responses(materialId):
     """获取材料的答卷记录"""
     responses = UserResponse.query.filter_by(material_id=materialId).order_by(UserResponse.created_at.desc()).all()
@@ -756,6 +1670,7 @@ def get_material_responses(materialId):
 
 # Admin User Response Routes
 @api_bp.route('/admin/user-responses', methods=['GET'])
+@auth_required('ADMIN')
 def get_all_user_responses():
     """管理员获取所有答卷记录"""
     responses = UserResponse.query.order_by(UserResponse.created_at.desc()).all()
@@ -792,6 +1707,7 @@ def get_all_user_responses():
     return jsonify(result)
 
 @api_bp.route('/admin/user-responses/<int:id>', methods=['GET'])
+@auth_required('ADMIN')
 def get_user_response_detail(id):
     """管理员获取单个答卷详情"""
     response = UserResponse.query.get(id)
@@ -827,6 +1743,7 @@ def get_user_response_detail(id):
     return jsonify(data)
 
 @api_bp.route('/admin/user-responses/<int:id>', methods=['PUT'])
+@auth_required('ADMIN')
 def update_user_response(id):
     """管理员更新答卷内容"""
     response = UserResponse.query.get(id)
@@ -845,6 +1762,7 @@ def update_user_response(id):
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/admin/user-responses/<int:id>', methods=['DELETE'])
+@auth_required('ADMIN')
 def delete_user_response(id):
     """管理员删除答卷"""
     response = UserResponse.query.get(id)
@@ -860,6 +1778,7 @@ def delete_user_response(id):
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/admin/user-responses/<int:id>/download', methods=['GET'])
+@auth_required('ADMIN')
 def download_user_response(id):
     """下载单个答卷为JSON"""
     response = UserResponse.query.get(id)
@@ -900,6 +1819,7 @@ def download_user_response(id):
     )
 
 @api_bp.route('/admin/user-responses/export', methods=['POST'])
+@auth_required('ADMIN')
 def export_user_responses():
     """批量导出答卷"""
     data = request.get_json() or {}
@@ -947,9 +1867,8 @@ def export_user_responses():
         headers={'Content-Disposition': 'attachment;filename=responses_export.json'}
     )
 
-@api_bp.route('/upload-epub', methods=['POST'])
-def upload_epub():
-    """上传EPUB文件"""
+def _handle_upload(kind):
+    """处理EPUB/MD上传：按内容哈希存储，名称映射到内容"""
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
@@ -961,53 +1880,262 @@ def upload_epub():
     
     if not filename:
         return jsonify({'error': 'No filename provided'}), 400
-    
-    # Ensure the epub_files directory exists
-    upload_dir = os.path.join(os.path.dirname(__file__), 'epub_files')
-    if not os.path.exists(upload_dir):
-        os.makedirs(upload_dir)
-    
-    # Save the file
-    filepath = os.path.join(upload_dir, filename)
-    file.save(filepath)
-    
-    return jsonify({'success': True, 'filename': filename, 'filepath': filepath}), 201
+
+    if not storage.is_valid_name(filename):
+        return jsonify({'error': 'Invalid filename'}), 400
+
+    try:
+        stored, deduplicated, replaced = storage.store_upload(kind, filename, file.stream)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Upload {kind} error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    return _stored_file_response(kind, stored, deduplicated, replaced)
+
+def _stored_file_response(kind, stored, deduplicated, replaced):
+    """上传完成后的响应，url 为按内容哈希寻址、可永久缓存的地址"""
+    # EPUB在后台预解析章节索引，上传请求无需等待
+    if kind == 'epub':
+        epub_index.schedule(stored.sha256, storage.blob_path(kind, stored.sha256))
+    # Markdown在上传时即渲染并缓存，首次阅读无需等待；失败时留到首次请求再渲染
+    elif kind == 'md':
+        try:
+            md_render.get_rendered(stored.sha256, storage.blob_path(kind, stored.sha256))
+        except Exception as e:
+            print(f"Render markdown error: {e}")
+
+    return jsonify({
+        'success': True,
+        'filename': stored.name,
+        'filepath': storage.blob_path(kind, stored.sha256),
+        'url': f'/api/blobs/{kind}/{stored.sha256}',
+        'sha256': stored.sha256,
+        'size': stored.size,
+        'deduplicated': deduplicated,
+        'replaced': replaced is not None
+    }), 201
+
+def _serve_stored(kind, filename):
+    """按名称提供已上传的文件，支持Range请求；名称可能被重新指向，因此每次需重新验证"""
+    location = storage.resolve(kind, filename)
+    if not location:
+        return jsonify({'error': 'File not found'}), 404
+    directory, name, sha256 = location
+    response = send_from_directory(directory, name, as_attachment=False, etag=sha256 or True)
+    response.headers['Cache-Control'] = 'no-cache'
+    if sha256:
+        response.headers['Content-Location'] = f'/api/blobs/{kind}/{sha256}'
+    return response
+
+@api_bp.route('/blobs/<string:kind>/<string:sha256>', methods=['GET'])
+def serve_blob(kind, sha256):
+    """按内容哈希提供文件：内容不可变，允许客户端永久缓存，支持Range请求"""
+    location = storage.resolve_blob(kind, sha256)
+    if not location:
+        return jsonify({'error': 'File not found'}), 404
+    directory, name = location
+    response = send_from_directory(directory, name, as_attachment=False, etag=sha256)
+    response.headers['Cache-Control'] = f"public, max-age={current_app.config['IMMUTABLE_MAX_AGE']}, immutable"
+    return response
+
+def _upload_error(e):
+    """分块上传错误响应，附带当前已确认的偏移以便客户端续传"""
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
+# Chunked Upload Routes
+@api_bp.route('/uploads', methods=['POST'])
+@auth_required('ADMIN')
+def create_upload():
+    """创建分块上传会话"""
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+
+    required_fields = ['kind', 'filename', 'size']
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'Missing required field: {field}'}), 400
+
+    try:
+        meta = uploads.create_session(
+            data['kind'], data['filename'], data['size'], data.get('sha256'),
+            max_size=current_app.config['CHUNKED_UPLOAD_MAX_SIZE']
+        )
+    except uploads.UploadError as e:
+        return _upload_error(e)
+
+    meta['chunkSize'] = current_app.config['CHUNKED_UPLOAD_CHUNK_SIZE']
+    return jsonify(meta), 201
+
+@api_bp.route('/uploads/<string:upload_id>', methods=['GET'])
+@auth_required('ADMIN')
+def get_upload(upload_id):
+    """查询上传进度，断线后从返回的 offset 继续上传"""
+    meta = uploads.load_session(upload_id)
+    if not meta:
+        return jsonify({'error': 'Upload not found'}), 404
+    meta['chunkSize'] = current_app.config['CHUNKED_UPLOAD_CHUNK_SIZE']
+    return jsonify(meta)
+
+@api_bp.route('/uploads/<string:upload_id>', methods=['PUT'])
+@auth_required('ADMIN')
+def put_upload_chunk(upload_id):
+    """上传一个分块，请求体为原始字节，?offset= 或 Upload-Offset 头指定写入位置"""
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Missing offset'}), 400
+
+    try:
+        new_offset = uploads.append_chunk(upload_id, offset, request.stream)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return jsonify({'uploadId': upload_id, 'offset': new_offset})
+
+@api_bp.route('/uploads/<string:upload_id>/finalize', methods=['POST'])
+@auth_required('ADMIN')
+def finalize_upload(upload_id):
+    """完成分块上传：校验后存入内容寻址存储"""
+    meta = uploads.load_session(upload_id)
+    try:
+        stored, deduplicated, replaced = uploads.finalize(upload_id)
+        db.session.commit()
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Finalize upload error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    return _stored_file_response(meta['kind'], stored, deduplicated, replaced)
+
+@api_bp.route('/uploads/<string:upload_id>', methods=['DELETE'])
+@auth_required('ADMIN')
+def abort_upload(upload_id):
+    """取消分块上传"""
+    if not uploads.abort(upload_id):
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify({'success': True})
+
+@api_bp.route('/upload-epub', methods=['POST'])
+@auth_required('ADMIN')
+def upload_epub():
+    """上传EPUB文件"""
+    return _handle_upload('epub')
 
 @api_bp.route('/upload-md', methods=['POST'])
+@auth_required('ADMIN')
 def upload_md():
     """上传MD文件"""
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    filename = request.form.get('filename')
-    
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-    
-    if not filename:
-        return jsonify({'error': 'No filename provided'}), 400
-    
-    upload_dir = os.path.join(os.path.dirname(__file__), 'md_files')
-    if not os.path.exists(upload_dir):
-        os.makedirs(upload_dir)
-    
-    # Save the file
-    filepath = os.path.join(upload_dir, filename)
-    file.save(filepath)
-    
-    return jsonify({'success': True, 'filename': filename, 'filepath': filepath}), 201
+    return _handle_upload('md')
 
 # Serve EPUB files
 @api_bp.route('/epub-files/<filename>', methods=['GET'])
 def serve_epub(filename):
     """提供EPUB文件下载/访问"""
-    epub_dir = os.path.join(os.path.dirname(__file__), 'epub_files')
-    return send_from_directory(epub_dir, filename, as_attachment=False)
+    return _serve_stored('epub', filename)
 
 # Serve MD files
 @api_bp.route('/md-files/<filename>', methods=['GET'])
 def serve_md(filename):
     """提供MD文件下载/访问"""
-    md_dir = os.path.join(os.path.dirname(__file__), 'md_files')
-    return send_from_directory(md_dir, filename, as_attachment=False)
+    return _serve_stored('md', filename)
+
+@api_bp.route('/md-files/<filename>/rendered', methods=['GET'])
+def get_rendered_md(filename):
+    """获取服务端渲染并清洗后的HTML及章节索引，按内容哈希缓存"""
+    location = storage.resolve('md', filename)
+    if not location:
+        return jsonify({'error': 'File not found'}), 404
+    directory, name, sha256 = location
+    path = os.path.join(directory, name)
+    if not os.path.isfile(path):
+        return jsonify({'error': 'File not found'}), 404
+    sha256 = sha256 or storage.legacy_sha256(path)
+
+    etag = f'{sha256}-r{md_render.RENDER_VERSION}'
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        rendered = md_render.get_rendered(sha256, path)
+    except Exception as e:
+        print(f"Render markdown error: {e}")
+        return jsonify({'error': str(e)}), 500
+    return with_validators(jsonify(rendered), etag)
+
+def _epub_book(filename):
+    """按文件名定位EPUB，返回 (内容哈希, 文件路径)；历史文件的哈希按修改时间缓存"""
+    location = storage.resolve('epub', filename)
+    if not location:
+        return None
+    directory, name, sha256 = location
+    path = os.path.join(directory, name)
+    return sha256 or storage.legacy_sha256(path), path
+
+@api_bp.route('/epub-files/<filename>/toc', methods=['GET'])
+def get_epub_toc(filename):
+    """获取EPUB目录与书脊；尚未解析时触发后台解析并返回202"""
+    book = _epub_book(filename)
+    if not book:
+        return jsonify({'error': 'File not found'}), 404
+    sha256, path = book
+
+    state = epub_index.status(sha256)
+    if state == 'failed':
+        return jsonify({'error': 'EPUB could not be parsed', 'status': state}), 422
+    if state != 'ready':
+        epub_index.schedule(sha256, path)
+        return jsonify({'status': 'pending'}), 202, {'Retry-After': '1'}
+
+    cached = not_modified(sha256)
+    if cached:
+        return cached
+
+    index = epub_index.load_index(sha256)
+    base_url = f'/api/epub-books/{sha256}/'
+    # 压缩包内的路径可能含空格、#、? 等字符，拼入URL前需转义
+    for entry in index['spine']:
+        entry['url'] = base_url + quote(entry['path'])
+    for entry in index['toc']:
+        entry['url'] = base_url + quote(entry['path']) if entry['path'] else None
+    index.update({'status': state, 'sha256': sha256, 'baseUrl': base_url})
+    return with_validators(jsonify(index), sha256)
+
+@api_bp.route('/epub-files/<filename>/chapters/<int:index>', methods=['GET'])
+def get_epub_chapter(filename, index):
+    """获取书脊中的单个章节，重定向到按内容哈希寻址的地址，章节内的相对资源路径可直接解析"""
+    book = _epub_book(filename)
+    if not book:
+        return jsonify({'error': 'File not found'}), 404
+    sha256, path = book
+
+    if epub_index.status(sha256) != 'ready':
+        epub_index.schedule(sha256, path)
+        return jsonify({'status': 'pending'}), 202, {'Retry-After': '1'}
+
+    spine = epub_index.load_index(sha256)['spine']
+    if index < 0 or index >= len(spine):
+        return jsonify({'error': 'Chapter not found'}), 404
+    return redirect(f"/api/epub-books/{sha256}/{quote(spine[index]['path'])}")
+
+EPUB_ASSET_CSP = "sandbox; default-src 'self'; script-src 'none'"
+
+@api_bp.route('/epub-books/<string:sha256>/<path:asset>', methods=['GET'])
+def serve_epub_asset(sha256, asset):
+    """提供解压后的章节与资源文件，内容按哈希寻址，可永久缓存"""
+    if not storage.is_valid_sha256(sha256) or epub_index.status(sha256) != 'ready':
+        return jsonify({'error': 'Book not found'}), 404
+    response = send_from_directory(epub_index.book_dir(sha256), asset, as_attachment=False)
+    response.headers['Cache-Control'] = f"public, max-age={current_app.config['IMMUTABLE_MAX_AGE']}, immutable"
+    # 书中内容未经清洗且与API同源：禁止脚本并放入沙箱（不透明源，拿不到本站会话），禁止类型嗅探
+    response.headers['Content-Security-Policy'] = EPUB_ASSET_CSP
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
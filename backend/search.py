@@ -0,0 +1,64 @@
+# 材料全文检索：分词与索引词条生成
+import html
+import math
+import re
+import unicodedata
+from collections import Counter
+from db import db
+from models import MaterialTerm
+
+# 各字段命中的权重
+FIELD_WEIGHTS = {'title': 3.0, 'author': 2.0, 'content': 1.0}
+
+# 正文参与索引的材料类型（其他类型的 content 为URL或文件路径）
+INDEXED_CONTENT_TYPES = ('TEXT', 'HTML')
+
+MAX_TERM_LENGTH = 64
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af'  # 中日韩统一表意文字、假名、谚文
+_TOKEN_RE = re.compile(f'([{_CJK}]+)|([0-9a-z]+)')
+_TAG_RE = re.compile(r'<[^>]+>')
+
+def _normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+def tokenize(text, unigrams=True):
+    """分词：中日韩文字切分为二元组(bigram)，字母数字按单词切分
+
+    索引时同时产生单字词条，以支持单字查询；查询时仅对单字片段使用单字。
+    """
+    for match in _TOKEN_RE.finditer(_normalize(text)):
+        cjk, word = match.groups()
+        if word:
+            yield word[:MAX_TERM_LENGTH]
+            continue
+        if len(cjk) == 1 or unigrams:
+            yield from cjk
+        for i in range(len(cjk) - 1):
+            yield cjk[i:i + 2]
+
+def query_terms(text):
+    """将查询语句转换为去重后的词条列表"""
+    return list(dict.fromkeys(tokenize(text, unigrams=False)))
+
+def material_terms(title, author, material_type, content):
+    """计算材料的索引词条及权重：sum(字段权重 * (1 + log(tf)))"""
+    fields = {'title': title, 'author': author}
+    if material_type in INDEXED_CONTENT_TYPES:
+        fields['content'] = html.unescape(_TAG_RE.sub(' ', content)) if material_type == 'HTML' else content
+
+    weights = Counter()
+    for field, text in fields.items():
+        for term, tf in Counter(tokenize(text)).items():
+            weights[term] += FIELD_WEIGHTS[field] * (1 + math.log(tf))
+    return weights
+
+def reindex_material(material):
+    """重建单个材料的检索词条，在调用方的事务中执行"""
+    MaterialTerm.query.filter_by(material_id=material.id).delete()
+    weights = material_terms(material.title, material.author, material.type, material.content)
+    if weights:
+        db.session.execute(MaterialTerm.__table__.insert(), [
+            {'material_id': material.id, 'term': term, 'weight': weight}
+            for term, weight in weights.items()
+        ])
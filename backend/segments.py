@@ -0,0 +1,98 @@
+# 长文本材料分段
+import hashlib
+import re
+
+# 需要分段的材料类型
+SEGMENTED_TYPES = ('TEXT', 'HTML')
+
+_TAG_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9]*)\b[^>]*?(/?)>')
+_HEADING_RE = re.compile(r'<h[1-6]\b[^>]*>(.*?)</h[1-6]>', re.IGNORECASE | re.DOTALL)
+_BLOCK_TAGS = {'p', 'div', 'section', 'article', 'blockquote', 'ul', 'ol', 'table', 'pre',
+               'figure', 'header', 'footer', 'aside', 'nav', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr'}
+_VOID_TAGS = {'br', 'hr', 'img', 'input', 'meta', 'link', 'source', 'wbr', 'col', 'area', 'embed', 'track'}
+
+def _split_text(content):
+    """纯文本按空行切分段落，返回 (起始偏移, 结束偏移, 是否标题) 列表"""
+    pieces = []
+    start = 0
+    for match in re.finditer(r'\n\s*\n', content):
+        pieces.append((start, match.end()))
+        start = match.end()
+    if start < len(content):
+        pieces.append((start, len(content)))
+    return [(s, e, content[s:e].lstrip().startswith('#')) for s, e in pieces]
+
+def _split_html(content):
+    """HTML按顶层块级元素切分，只在嵌套深度为0处断开，保证每段标签闭合"""
+    pieces = []
+    depth = 0
+    start = 0
+    for match in _TAG_RE.finditer(content):
+        closing, tag, self_closing = match.group(1), match.group(2).lower(), match.group(3)
+        if tag in _VOID_TAGS or self_closing:
+            if depth == 0 and tag == 'hr':
+                pieces.append((start, match.end()))
+                start = match.end()
+            continue
+        if closing:
+            depth = max(0, depth - 1)
+            if depth == 0 and tag in _BLOCK_TAGS:
+                pieces.append((start, match.end()))
+                start = match.end()
+        else:
+            if depth == 0 and re.match(r'h[1-6]$', tag) and match.start() > start:
+                # 标题前断开，使标题成为新片段的开头
+                pieces.append((start, match.start()))
+                start = match.start()
+            depth += 1
+    if start < len(content):
+        pieces.append((start, len(content)))
+    return [(s, e, bool(re.match(r'\s*<h[1-6]\b', content[s:e], re.IGNORECASE))) for s, e in pieces]
+
+def _heading_of(material_type, text):
+    """提取片段的标题，用于目录显示"""
+    if material_type == 'HTML':
+        match = _HEADING_RE.search(text)
+        if match:
+            return re.sub(r'<[^>]+>', '', match.group(1)).strip()[:255] or None
+        return None
+    first_line = text.strip().split('\n', 1)[0].strip()
+    return first_line.lstrip('#').strip()[:255] if first_line.startswith('#') else None
+
+def build_segments(material_type, content, target_chars=4000):
+    """将材料正文切分为稳定的片段
+
+    相邻段落合并至约 target_chars 字符；遇到标题时只要当前片段超过目标的一半就另起一段。
+    相同内容总是得到相同的切分结果。返回字典列表：seq/start/end/heading/content/checksum。
+    """
+    if material_type not in SEGMENTED_TYPES or not content:
+        return []
+
+    pieces = _split_html(content) if material_type == 'HTML' else _split_text(content)
+
+    ranges = []
+    seg_start, seg_end = None, None
+    for start, end, is_heading in pieces:
+        if seg_start is None:
+            seg_start, seg_end = start, end
+            continue
+        size = seg_end - seg_start
+        if (is_heading and size >= target_chars // 2) or size + (end - start) > target_chars:
+            ranges.append((seg_start, seg_end))
+            seg_start = start
+        seg_end = end
+    if seg_start is not None:
+        ranges.append((seg_start, seg_end))
+
+    segments = []
+    for seq, (start, end) in enumerate(ranges):
+        text = content[start:end]
+        segments.append({
+            'seq': seq,
+            'start': start,
+            'end': end,
+            'heading': _heading_of(material_type, text),
+            'content': text,
+            'checksum': hashlib.sha1(text.encode('utf-8')).hexdigest()
+        })
+    return segments
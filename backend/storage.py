@@ -0,0 +1,180 @@
+# 上传文件的内容寻址存储
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from db import db
+from models import StoredFile
+
+BASE_DIR = os.path.dirname(__file__)
+
+# 文件类别 -> (存储目录, 扩展名)
+STORAGE_KINDS = {
+    'epub': ('epub_files', '.epub'),
+    'md': ('md_files', '.md')
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# 历史文件的哈希缓存：路径 -> (修改时间, 大小, 哈希)，文件被改写后自动重新计算
+_legacy_hashes = {}
+_legacy_lock = threading.Lock()
+
+def storage_dir(kind):
+    """类别的根目录，历史上传的文件直接保存在这里"""
+    return os.path.join(BASE_DIR, STORAGE_KINDS[kind][0])
+
+def blob_dir(kind):
+    return os.path.join(storage_dir(kind), 'blobs')
+
+def blob_path(kind, sha256):
+    """内容文件路径：blobs/<哈希前两位>/<哈希><扩展名>"""
+    return os.path.join(blob_dir(kind), sha256[:2], sha256 + STORAGE_KINDS[kind][1])
+
+def is_valid_name(name):
+    """文件名只作为映射键，不允许包含路径"""
+    return bool(name) and name not in ('.', '..') and os.path.basename(name) == name and '\\' not in name
+
+def store_upload(kind, name, stream):
+    """边写临时文件边计算哈希，再按哈希落盘并更新名称映射
+
+    返回 (StoredFile, 是否去重, 被替换的旧哈希或None)，调用方负责提交事务。
+    """
+    os.makedirs(blob_dir(kind), exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=blob_dir(kind), prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+        return store_file(kind, name, tmp_path, digest.hexdigest(), size)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def store_file(kind, name, path, sha256, size):
+    """将已计算好哈希的本地文件移入内容存储并更新名称映射
+
+    相同内容的文件只保存一份，已存在时直接删除传入的文件。
+    返回 (StoredFile, 是否去重, 被替换的旧哈希或None)，调用方负责提交事务。
+    """
+    target = blob_path(kind, sha256)
+    deduplicated = os.path.exists(target)
+    if deduplicated:
+        # 刷新修改时间，避免垃圾回收在映射提交前删除该内容
+        os.utime(target)
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    stored, replaced = link_blob(kind, name, sha256, size)
+    return stored, deduplicated, replaced
+
+def link_blob(kind, name, sha256, size):
+    """将名称指向内容哈希，返回 (StoredFile, 被替换的旧哈希或None)"""
+    stored = StoredFile.query.filter_by(kind=kind, name=name).with_for_update().first()
+    replaced = None
+    if stored:
+        if stored.sha256 != sha256:
+            replaced = stored.sha256
+        stored.sha256 = sha256
+        stored.size = size
+    else:
+        stored = StoredFile(kind=kind, name=name, sha256=sha256, size=size)
+        db.session.add(stored)
+    return stored, replaced
+
+def resolve(kind, name):
+    """按名称查找文件，返回 (目录, 文件名, 内容哈希)
+
+    兼容内容寻址之前按原名保存的文件，此时哈希为None。
+    """
+    if not is_valid_name(name):
+        return None
+    stored = StoredFile.query.filter_by(kind=kind, name=name).first()
+    if stored:
+        path = blob_path(kind, stored.sha256)
+        if os.path.exists(path):
+            return os.path.dirname(path), os.path.basename(path), stored.sha256
+    legacy = os.path.join(storage_dir(kind), name)
+    if os.path.isfile(legacy):
+        return storage_dir(kind), name, None
+    return None
+
+def file_sha256(path):
+    """计算本地文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def legacy_sha256(path):
+    """历史文件（按原名保存、没有映射记录）的内容哈希，按路径与修改时间缓存"""
+    stat = os.stat(path)
+    with _legacy_lock:
+        cached = _legacy_hashes.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    sha256 = file_sha256(path)
+    with _legacy_lock:
+        _legacy_hashes[path] = (stat.st_mtime_ns, stat.st_size, sha256)
+    return sha256
+
+def legacy_hashes(kind):
+    """类别根目录下历史文件的内容哈希集合，用于清理派生缓存时保留它们"""
+    root = storage_dir(kind)
+    if not os.path.isdir(root):
+        return set()
+    hashes = set()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not name.startswith('.') and os.path.isfile(path):
+            hashes.add(legacy_sha256(path))
+    return hashes
+
+def is_valid_sha256(value):
+    return bool(_SHA256_RE.match(value or ''))
+
+def resolve_blob(kind, sha256):
+    """按内容哈希查找文件，返回 (目录, 文件名)"""
+    if kind not in STORAGE_KINDS or not is_valid_sha256(sha256):
+        return None
+    path = blob_path(kind, sha256)
+    if not os.path.exists(path):
+        return None
+    return os.path.dirname(path), os.path.basename(path)
+
+def collect_garbage(kind, grace_seconds=3600):
+    """删除没有任何名称引用的内容文件，返回 (删除数量, 释放字节数)
+
+    只清理超过 grace_seconds 的文件，避免误删正在上传、尚未提交映射的内容。
+    """
+    referenced = {row[0] for row in db.session.query(StoredFile.sha256).filter_by(kind=kind).distinct()}
+    removed, freed = 0, 0
+    cutoff = time.time() - grace_seconds
+    root = blob_dir(kind)
+    if not os.path.isdir(root):
+        return removed, freed
+
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            sha256 = os.path.splitext(filename)[0]
+            if sha256 in referenced or os.path.getmtime(path) > cutoff:
+                continue
+            freed += os.path.getsize(path)
+            os.remove(path)
+            removed += 1
+    return removed, freed
@@ -0,0 +1,29 @@
+# 测试环境：使用内存SQLite，关闭强制认证与日志写后缓冲
+import os
+import sys
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['AUTH_REQUIRED'] = ''
+os.environ['LOG_WRITE_BEHIND'] = ''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture(scope='session')
+def app():
+    # 蓝图只能注册一次，整个测试会话共用一个应用
+    from app import create_app
+
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+@pytest.fixture()
+def client(app):
+    from db import db
+
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
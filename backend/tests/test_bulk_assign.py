@@ -0,0 +1,37 @@
+# 材料分配接口的参数校验
+import pytest
+from db import db
+from models import User, Material, MaterialAssignment
+
+@pytest.fixture()
+def seeded(client):
+    db.session.add(User(phone_number='13800000001', name='a', role='PARTICIPANT', group='A'))
+    db.session.add(Material(id='m1', title='t', type='TEXT', content='x'))
+    db.session.commit()
+
+@pytest.mark.parametrize('body', [
+    {'materialIds': ['m1'], 'userIds': None},
+    {'materialIds': ['m1'], 'userIds': '13800000001'},
+    {'materialIds': ['m1'], 'userIds': [13800000001]},
+    {'materialIds': 'm1', 'userIds': ['13800000001']},
+    {'materialIds': [['m1']], 'userIds': ['13800000001']},
+    {'materialIds': ['m1'], 'group': ['A']},
+    {'materialIds': ['m1']},
+    ['m1'],
+])
+def test_bulk_assign_rejects_invalid_ids(client, seeded, body):
+    assert client.post('/api/materials/bulk-assign', json=body).status_code == 400
+    assert MaterialAssignment.query.count() == 0
+
+@pytest.mark.parametrize('user_ids', [None, '13800000001', [{'id': 1}]])
+def test_assign_rejects_invalid_user_ids(client, seeded, user_ids):
+    assert client.post('/api/materials/m1/assign', json={'userIds': user_ids}).status_code == 400
+
+def test_bulk_assign_by_ids_and_group(client, seeded):
+    response = client.post('/api/materials/bulk-assign', json={'materialIds': ['m1', 'm9'], 'userIds': ['13800000001']})
+    assert response.status_code == 200
+    assert response.get_json()['inserted'] == 1
+    assert response.get_json()['missingMaterialIds'] == ['m9']
+
+    response = client.post('/api/materials/bulk-assign', json={'materialIds': ['m1'], 'group': 'A'})
+    assert response.get_json()['skipped'] == 1
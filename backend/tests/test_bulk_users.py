@@ -0,0 +1,52 @@
+# 批量导入用户：CSV解码、逐行类型校验与状态码
+import io
+import pytest
+from db import db
+from models import User
+
+@pytest.fixture(autouse=True)
+def fast_hashing(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'BCRYPT_ROUNDS', 4)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+
+def test_csv_upload_with_invalid_encoding(client):
+    body = 'phone_number,name,role\n13800000001,张三,PARTICIPANT\n'.encode('gbk')
+    response = client.post('/api/users/bulk', data={'file': (io.BytesIO(body), 'users.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert 'UTF-8' in response.get_json()['error']
+
+def test_csv_body_with_invalid_encoding(client):
+    body = 'phone_number,name,role\n13800000001,张三,PARTICIPANT\n'.encode('gbk')
+    response = client.post('/api/users/bulk', data=body, content_type='text/csv')
+    assert response.status_code == 400
+
+def test_csv_upload(client):
+    body = '﻿phone_number,name,role,age\n13800000001,张三,PARTICIPANT,30\n'.encode('utf-8')
+    response = client.post('/api/users/bulk', data={'file': (io.BytesIO(body), 'users.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 201
+    assert db.session.get(User, '13800000001').age == 30
+
+def test_field_types_are_validated_per_row(client):
+    response = client.post('/api/users/bulk', json=[
+        {'phone_number': '13800000001', 'name': 'a', 'role': 'PARTICIPANT', 'email': 123},
+        {'phone_number': '13800000002', 'name': ['b'], 'role': 'PARTICIPANT'},
+        {'phone_number': '13800000003', 'name': 'c', 'role': 'PARTICIPANT', 'age': 'old'},
+        {'phone_number': '13800000004', 'name': 'd', 'role': 'PARTICIPANT', 'age': True},
+        {'phone_number': 13800000005, 'name': 'e', 'role': 'PARTICIPANT', 'income': '5000'},
+    ])
+    assert response.status_code == 201
+    body = response.get_json()
+    assert [r['status'] for r in body['results']] == ['error', 'error', 'error', 'error', 'created']
+    assert body['results'][0]['error'] == 'Invalid field type: email'
+    assert body['results'][2]['error'] == 'Invalid numeric field: age'
+    assert db.session.get(User, '13800000005').income == 5000
+
+def test_nothing_created_returns_200(client):
+    rows = [{'phone_number': '13800000001', 'name': 'a', 'role': 'PARTICIPANT'}]
+    assert client.post('/api/users/bulk', json=rows).status_code == 201
+    response = client.post('/api/users/bulk', json=rows)
+    assert response.status_code == 200
+    assert response.get_json()['created'] == 0
+    assert response.get_json()['skipped'] == 1
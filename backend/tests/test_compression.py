@@ -0,0 +1,42 @@
+# 压缩响应的条件请求：带编码后缀的强ETag仍能命中304
+import io
+import os
+import pytest
+import md_render
+import storage
+
+@pytest.fixture()
+def md_file(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(md_render, 'RENDER_DIR', str(tmp_path / 'rendered'))
+    body = ('# 标题\n\n' + '正文内容。' * 2000).encode('utf-8')
+    response = client.post('/api/upload-md', data={'file': (io.BytesIO(body), 'notes.md'), 'filename': 'notes.md'},
+                           content_type='multipart/form-data')
+    assert response.status_code in (200, 201)
+    assert os.path.isfile(response.get_json()['filepath'])
+    return 'notes.md'
+
+@pytest.mark.parametrize('encoding', ['gzip', 'br'])
+def test_encoded_etag_revalidates(client, md_file, encoding):
+    if encoding == 'br':
+        pytest.importorskip('brotli')
+    headers = {'Accept-Encoding': encoding}
+    first = client.get(f'/api/md-files/{md_file}', headers=headers)
+    assert first.status_code == 200
+    assert first.headers['Content-Encoding'] == encoding
+    etag = first.headers['ETag']
+    assert etag.endswith(f'-{encoding}"')
+
+    second = client.get(f'/api/md-files/{md_file}', headers={**headers, 'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+
+    blob = first.headers['Content-Location']
+    third = client.get(blob, headers={**headers, 'If-None-Match': client.get(blob, headers=headers).headers['ETag']})
+    assert third.status_code == 304
+
+def test_plain_etag_still_matches(client, md_file):
+    first = client.get(f'/api/md-files/{md_file}', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in first.headers
+    second = client.get(f'/api/md-files/{md_file}', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 304
@@ -0,0 +1,76 @@
+# 封面缩略图：失败重试退避与WebP协商
+import json
+import os
+import pytest
+import covers
+from db import db
+from models import Material
+
+@pytest.fixture()
+def cover_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(covers, 'COVER_DIR', str(tmp_path))
+    return tmp_path
+
+def _age(path, seconds):
+    marked_at = os.path.getmtime(path) - seconds
+    os.utime(path, (marked_at, marked_at))
+
+def test_failure_marker_expires_with_backoff(cover_dir):
+    key = covers.cover_key('https://example.com/a.jpg')
+    covers.mark_failed(key, ValueError('boom'))
+    assert covers.status(key) == 'failed'
+
+    error_path = cover_dir / f'{key}.error'
+    _age(error_path, covers.retry_delay(1) + 1)
+    assert covers.status(key) == 'missing'
+
+    covers.mark_failed(key, ValueError('boom again'))
+    assert json.loads(error_path.read_text())['attempts'] == 2
+    _age(error_path, covers.retry_delay(1) + 1)
+    assert covers.status(key) == 'failed'
+    _age(error_path, covers.retry_delay(2))
+    assert covers.status(key) == 'missing'
+
+def test_legacy_text_marker_is_retried(cover_dir):
+    key = covers.cover_key('https://example.com/b.jpg')
+    error_path = cover_dir / f'{key}.error'
+    error_path.write_text('old failure')
+    assert covers.status(key) == 'failed'
+    _age(error_path, covers.RETRY_MAX_SECONDS)
+    assert covers.status(key) == 'missing'
+
+def _ready_cover(cover_dir, material_id, url):
+    """创建带封面的材料并写入已生成的缩略图，返回封面key"""
+    db.session.add(Material(id=material_id, title='t', type='TEXT', content='x', cover_url=url))
+    db.session.commit()
+    key = covers.cover_key(url)
+    os.makedirs(covers.cover_dir(key))
+    for width in (160, 320, 640):
+        for ext in covers.FORMATS:
+            (cover_dir / key / f'{width}.{ext}').write_bytes(b'image')
+    (cover_dir / key / covers.META_FILE).write_text('{}')
+    return key
+
+@pytest.mark.parametrize('accept, mimetype', [
+    ('image/webp,image/*;q=0.8', 'image/webp'),
+    ('*/*', 'image/jpeg'),
+    ('image/*', 'image/jpeg'),
+    ('image/webp;q=0, */*', 'image/jpeg'),
+    (None, 'image/jpeg'),
+])
+def test_webp_only_when_explicitly_accepted(client, cover_dir, accept, mimetype):
+    key = _ready_cover(cover_dir, 'mat_1', 'https://example.com/c.jpg')
+
+    headers = {'Accept': accept} if accept else {}
+    response = client.get(f'/api/materials/mat_1/cover/{key}?w=320', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == mimetype
+
+def test_cover_key_must_belong_to_material(client, cover_dir):
+    key = _ready_cover(cover_dir, 'mat_1', 'https://example.com/c.jpg')
+    db.session.add(Material(id='mat_2', title='t', type='TEXT', content='x', cover_url='https://example.com/d.jpg'))
+    db.session.commit()
+
+    assert client.get(f'/api/materials/mat_2/cover/{key}').status_code == 404
+    assert client.get(f'/api/materials/missing/cover/{key}').status_code == 404
+    assert client.get(f'/api/materials/mat_1/cover/{key}').status_code == 200
@@ -0,0 +1,109 @@
+# 历史文件（按原名保存、没有映射记录）的哈希缓存、垃圾回收与章节地址
+import os
+import zipfile
+from urllib.parse import unquote
+import pytest
+import epub_index
+import md_render
+import storage
+
+CONTAINER = '''<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>'''
+
+OPF = '''<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>Book</dc:title></metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    <item id="c1" href="Chapter%201%23a.xhtml" media-type="application/xhtml+xml"/>
+  </manifest>
+  <spine><itemref idref="c1"/></spine>
+</package>'''
+
+NAV = '''<?xml version="1.0"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops"><body>
+  <nav epub:type="toc"><ol><li><a href="Chapter%201%23a.xhtml">One</a></li></ol></nav>
+</body></html>'''
+
+@pytest.fixture()
+def legacy_dir(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(md_render, 'RENDER_DIR', os.path.join(storage.storage_dir('md'), 'rendered'))
+    monkeypatch.setattr(epub_index, 'EXTRACT_DIR', os.path.join(storage.storage_dir('epub'), 'extracted'))
+    for kind in storage.STORAGE_KINDS:
+        os.makedirs(storage.storage_dir(kind))
+    return tmp_path
+
+def _write_epub(path):
+    with zipfile.ZipFile(path, 'w') as book:
+        book.writestr('mimetype', 'application/epub+zip')
+        book.writestr('META-INF/container.xml', CONTAINER)
+        book.writestr('OEBPS/content.opf', OPF)
+        book.writestr('OEBPS/nav.xhtml', NAV)
+        book.writestr('OEBPS/Chapter 1#a.xhtml', '<html><body><script>alert(1)</script></body></html>')
+
+def test_legacy_hash_is_cached(client, legacy_dir, monkeypatch):
+    path = os.path.join(storage.storage_dir('md'), 'old.md')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# Old\n')
+
+    calls = []
+    file_sha256 = storage.file_sha256
+    monkeypatch.setattr(storage, 'file_sha256', lambda p: calls.append(p) or file_sha256(p))
+    for _ in range(3):
+        assert client.get('/api/md-files/old.md/rendered').status_code == 200
+    assert len(calls) == 1
+
+    # 文件被改写后重新计算
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# Changed heading\n')
+    assert 'Changed heading' in client.get('/api/md-files/old.md/rendered').get_json()['html']
+    assert len(calls) == 2
+
+def test_gc_keeps_legacy_derived_files(app, client, legacy_dir):
+    md_path = os.path.join(storage.storage_dir('md'), 'old.md')
+    with open(md_path, 'w', encoding='utf-8') as f:
+        f.write('# Old\n')
+    epub_path = os.path.join(storage.storage_dir('epub'), 'old.epub')
+    _write_epub(epub_path)
+
+    md_sha = storage.legacy_sha256(md_path)
+    epub_sha = storage.legacy_sha256(epub_path)
+    md_render.get_rendered(md_sha, md_path)
+    epub_index.extract(epub_sha, epub_path)
+
+    result = app.test_cli_runner().invoke(args=['gc-uploads'])
+    assert result.exit_code == 0, result.output
+    assert epub_index.status(epub_sha) == 'ready'
+    assert os.path.exists(md_render._cache_path(md_sha))
+
+def test_chapter_urls_are_quoted(client, legacy_dir):
+    epub_path = os.path.join(storage.storage_dir('epub'), 'old.epub')
+    _write_epub(epub_path)
+    epub_index.extract(storage.legacy_sha256(epub_path), epub_path)
+
+    index = client.get('/api/epub-files/old.epub/toc').get_json()
+    url = index['spine'][0]['url']
+    assert url.endswith('/OEBPS/Chapter%201%23a.xhtml')
+    assert index['toc'][0]['url'] == url
+
+    redirect = client.get('/api/epub-files/old.epub/chapters/0')
+    assert redirect.status_code == 302
+    assert redirect.headers['Location'] == url
+    assert client.get(url).status_code == 200
+    assert unquote(url).endswith('Chapter 1#a.xhtml')
+
+def test_epub_assets_are_sandboxed(client, legacy_dir):
+    epub_path = os.path.join(storage.storage_dir('epub'), 'old.epub')
+    _write_epub(epub_path)
+    epub_index.extract(storage.legacy_sha256(epub_path), epub_path)
+
+    url = client.get('/api/epub-files/old.epub/toc').get_json()['spine'][0]['url']
+    response = client.get(url)
+    assert response.status_code == 200
+    policy = response.headers['Content-Security-Policy']
+    assert policy.startswith('sandbox')
+    assert "script-src 'none'" in policy
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
@@ -0,0 +1,29 @@
+# 登录参数校验
+import pytest
+from db import db
+from models import User
+from passwords import hash_password, check_password
+
+@pytest.fixture()
+def user(client):
+    db.session.add(User(phone_number='13800000001', name='reader', role='PARTICIPANT',
+                        password=hash_password('secret', rounds=4)))
+    db.session.commit()
+    return '13800000001'
+
+@pytest.mark.parametrize('password', [None, 123, ['secret'], {'value': 'secret'}])
+def test_non_string_password_is_rejected(client, user, password):
+    response = client.post('/api/login', json={'phone_number': user, 'password': password})
+    assert response.status_code == 400
+
+def test_non_string_phone_number_is_rejected(client, user):
+    response = client.post('/api/login', json={'phone_number': {'a': 1}, 'password': 'secret'})
+    assert response.status_code == 400
+
+def test_valid_and_invalid_password(client, user):
+    assert client.post('/api/login', json={'phone_number': user, 'password': 'wrong'}).status_code == 401
+    assert client.post('/api/login', json={'phone_number': user, 'password': 'secret'}).status_code == 200
+
+def test_check_password_rejects_non_string():
+    assert check_password(None, hash_password('secret', rounds=4)) == (False, None)
+    assert check_password(None, None) == (False, None)
@@ -0,0 +1,108 @@
+# 图片代理：上游暂时不可用时返回503及Retry-After；no-cache 的缓存须先验证再返回
+import io
+import pytest
+import requests
+import http_client
+import proxy_cache
+
+@pytest.fixture(autouse=True)
+def fresh_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(proxy_cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(proxy_cache, '_instance', None)
+
+def _failing_get(error):
+    def get(url, **kwargs):
+        raise error
+    return get
+
+@pytest.mark.parametrize('error, retry_after', [
+    (http_client.HostBusy('Too many concurrent requests to example.com'), '1'),
+    (requests.ConnectionError('connection refused'), '5'),
+    (requests.Timeout('read timed out'), '5'),
+])
+def test_upstream_unavailable_returns_503(client, monkeypatch, error, retry_after):
+    monkeypatch.setattr(http_client, 'get', _failing_get(error))
+    response = client.get('/api/proxy?url=https://example.com/a.jpg')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == retry_after
+
+def test_streamed_proxy_host_busy_returns_503(client, monkeypatch):
+    def too_large(self, url):
+        raise proxy_cache.TooLarge()
+    monkeypatch.setattr(proxy_cache.ImageProxyCache, 'get', too_large)
+    monkeypatch.setattr(http_client, 'get', _failing_get(http_client.HostBusy('busy')))
+    response = client.get('/api/proxy?url=https://example.com/large.jpg')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+class _FakeSession:
+    """返回固定流式响应的Session，只替换网络部分，主机并发名额照常获取与归还"""
+
+    def request(self, method, url, stream=False, timeout=None, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'image/jpeg'
+        response.raw = io.BytesIO(b'x' * 100000)
+        response.url = url
+        return response
+
+def test_streamed_proxy_releases_host_slot_without_iteration(client, monkeypatch):
+    def too_large(self, url):
+        raise proxy_cache.TooLarge()
+    monkeypatch.setattr(proxy_cache.ImageProxyCache, 'get', too_large)
+    monkeypatch.setattr(http_client, 'get_session', lambda: _FakeSession())
+
+    url = '/api/proxy?url=https://big.example/large.jpg'
+    response = client.head(url)
+    assert response.status_code == 200
+    response.close()
+    assert http_client._host_inflight.get('big.example', 0) == 0
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert len(response.get_data()) == 100000
+    response.close()
+    assert http_client._host_inflight.get('big.example', 0) == 0
+
+class _NoCacheUpstream:
+    """返回 Cache-Control: no-cache 的上游，带匹配ETag的条件请求返回304"""
+
+    def __init__(self):
+        self.requests = []
+        self.error = None
+
+    def request(self, method, url, stream=False, timeout=None, headers=None, **kwargs):
+        self.requests.append(dict(headers or {}))
+        if self.error:
+            raise self.error
+        response = requests.Response()
+        response.url = url
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['ETag'] = '"v1"'
+        if (headers or {}).get('If-None-Match') == '"v1"':
+            response.status_code = 304
+            response.raw = io.BytesIO(b'')
+        else:
+            response.status_code = 200
+            response.headers['Content-Type'] = 'image/jpeg'
+            response.raw = io.BytesIO(b'image')
+        return response
+
+def test_no_cache_entry_is_revalidated_before_use(client, monkeypatch):
+    upstream = _NoCacheUpstream()
+    monkeypatch.setattr(http_client, 'get_session', lambda: upstream)
+    url = '/api/proxy?url=https://cdn.example/a.jpg'
+
+    first = client.get(url)
+    assert first.headers['X-Cache'] == 'MISS'
+    assert first.get_data() == b'image'
+
+    second = client.get(url)
+    assert second.headers['X-Cache'] == 'REVALIDATED'
+    assert second.get_data() == b'image'
+    assert len(upstream.requests) == 2
+    assert upstream.requests[1]['If-None-Match'] == '"v1"'
+
+    # 无法验证时不能返回旧内容
+    upstream.error = requests.ConnectionError('connection refused')
+    assert client.get(url).status_code == 503
@@ -0,0 +1,104 @@
+# 阅读会话：按事件时间配对、OPEN槽位唯一、汇总查询只读
+import random
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from db import db
+from models import beijing_tz, User, Material, Log, ReadingSession
+import reading_sessions
+
+TIMEOUT = 2 * 3600
+BASE = datetime(2026, 1, 1, 9, 0, 0)
+
+def _now():
+    # 数据库按北京时间存储不带时区的时间
+    return datetime.now(beijing_tz).replace(tzinfo=None)
+
+@pytest.fixture()
+def reader(client):
+    db.session.add(User(phone_number='13800000001', name='reader', role='PARTICIPANT', password='x', group='A'))
+    for material_id in ('m1', 'm2'):
+        db.session.add(Material(id=material_id, title='t', type='TEXT', content='x'))
+    db.session.commit()
+    return '13800000001'
+
+def _apply(rows):
+    """模拟写后缓冲：按给定的到达顺序逐批写入日志并更新会话"""
+    for row in rows:
+        db.session.execute(db.insert(Log), [row])
+        reading_sessions.apply_rows([row], TIMEOUT)
+        db.session.commit()
+
+def _event(user_id, action, material_id, minutes):
+    return {'user_id': user_id, 'action': action, 'material_id': material_id,
+            'created_at': BASE + timedelta(minutes=minutes)}
+
+def _sessions():
+    return sorted((s.material_id, s.status, s.opened_at, s.duration_seconds)
+                  for s in ReadingSession.query.all())
+
+def test_close_arriving_before_open(reader):
+    _apply([
+        _event(reader, 'CLOSE_MATERIAL', 'm1', 10),
+        _event(reader, 'OPEN_MATERIAL', 'm1', 0),
+    ])
+    assert _sessions() == [('m1', 'CLOSED', BASE, 600)]
+
+def test_out_of_order_matches_rebuild(reader):
+    events = []
+    for i in range(40):
+        material_id = random.Random(i).choice(['m1', 'm2'])
+        action = 'OPEN_MATERIAL' if i % 3 != 2 else 'CLOSE_MATERIAL'
+        events.append(_event(reader, action, material_id, i * 7))
+    shuffled = events[:]
+    random.Random(42).shuffle(shuffled)
+    _apply(shuffled)
+    incremental = _sessions()
+
+    reading_sessions.rebuild(TIMEOUT)
+    assert incremental == _sessions()
+
+def test_single_open_slot_per_user_material(reader):
+    for minutes in (0, 1):
+        db.session.add(ReadingSession(user_id=reader, material_id='m1', status='OPEN', is_open=True,
+                                      opened_at=BASE + timedelta(minutes=minutes)))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+def test_repeated_open_keeps_one_open_row(reader):
+    now = _now()
+    for minutes in (10, 5):
+        _apply([{'user_id': reader, 'action': 'OPEN_MATERIAL', 'material_id': 'm1',
+                 'created_at': now - timedelta(minutes=minutes)}])
+    statuses = [s.status for s in ReadingSession.query.order_by(ReadingSession.opened_at)]
+    assert statuses == ['TIMED_OUT', 'OPEN']
+
+def test_totals_is_read_only(app, client, reader):
+    assert app.config['READING_SESSION_TIMEOUT'] == TIMEOUT
+    now = _now()
+    _apply([
+        {'user_id': reader, 'action': 'OPEN_MATERIAL', 'material_id': 'm1', 'created_at': now - timedelta(minutes=30)},
+        {'user_id': reader, 'action': 'CLOSE_MATERIAL', 'material_id': 'm1', 'created_at': now - timedelta(minutes=20)},
+    ])
+    # 超时仍未关闭的会话直接写入为OPEN，模拟未整理的会话表
+    db.session.add(ReadingSession(user_id=reader, material_id='m2', status='OPEN', is_open=True,
+                                  opened_at=now - timedelta(seconds=TIMEOUT + 60)))
+    db.session.commit()
+
+    writes = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith('SELECT'):
+            writes.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get('/api/reading-sessions/totals?by=user')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    assert response.status_code == 200
+    assert writes == []
+    [row] = response.get_json()
+    assert (row['sessions'], row['totalSeconds'], row['timedOut']) == (1, 600, 1)
+    assert ReadingSession.query.filter_by(status='OPEN').count() == 1
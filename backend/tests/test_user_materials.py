@@ -0,0 +1,57 @@
+# 用户材料列表的查询次数不随分配数量增长
+import pytest
+from sqlalchemy import event
+from db import db
+from models import User, Material, MaterialAssignment
+
+USER_ID = '13800000001'
+
+def _seed(count):
+    db.session.add(User(phone_number=USER_ID, name='reader', role='PARTICIPANT', password='x'))
+    db.session.add(User(phone_number='13800000002', name='other', role='PARTICIPANT', password='x'))
+    for i in range(count):
+        material_id = f'mat_{i:03d}'
+        db.session.add(Material(id=material_id, title=f'title {i}', type='TEXT', content='text'))
+        db.session.add(MaterialAssignment(material_id=material_id, user_id=USER_ID, read_status=i % 2 == 0))
+        db.session.add(MaterialAssignment(material_id=material_id, user_id='13800000002'))
+    db.session.commit()
+    db.session.expunge_all()
+
+def _count_queries(client, path):
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+@pytest.mark.parametrize('view', ['', '?view=summary'])
+def test_query_count_is_constant(client, view):
+    counts = {}
+    for count in (1, 25):
+        _seed(count)
+        counts[count], materials = _count_queries(client, f'/api/users/{USER_ID}/materials{view}')
+        assert len(materials) == count
+        db.drop_all()
+        db.create_all()
+    assert counts[1] == counts[25]
+    assert counts[1] <= 2
+
+def test_materials_include_assigned_users(client):
+    # 参与者首页按 assignedToUserIds 过滤自己的材料
+    _seed(3)
+    materials = client.get(f'/api/users/{USER_ID}/materials').get_json()
+    assert [m['id'] for m in materials] == ['mat_000', 'mat_001', 'mat_002']
+    for material in materials:
+        assert sorted(material['assignedToUserIds']) == [USER_ID, '13800000002']
+    assert [m['readStatus'] for m in materials] == [True, False, True]
+
+def test_summary_omits_content(client):
+    _seed(1)
+    material = client.get(f'/api/users/{USER_ID}/materials?view=summary').get_json()[0]
+    assert 'content' not in material
+    assert 'assignedToUserIds' not in material
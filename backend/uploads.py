@@ -0,0 +1,200 @@
+# 分块断点续传上传：init -> 按偏移 PUT 分块 -> finalize
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+import storage
+
+# fcntl 仅在类Unix系统可用，其他平台退回为进程内锁（此时只支持单进程部署）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SESSION_DIR = os.path.join(storage.BASE_DIR, 'upload_sessions')
+
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+_thread_locks = defaultdict(threading.Lock)
+# 进程内的增量哈希状态：upload_id -> (已哈希的字节数, hashlib对象)，仅在持有会话锁时读写
+_hashers = {}
+
+class UploadError(Exception):
+    """分块上传错误，带HTTP状态码与当前已确认的偏移"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+def _meta_path(upload_id):
+    return os.path.join(SESSION_DIR, upload_id + '.json')
+
+def _part_path(upload_id):
+    return os.path.join(SESSION_DIR, upload_id + '.part')
+
+def _save_meta(meta):
+    """原子写入会话元数据，offset 即已确认写入的字节数"""
+    tmp_path = _meta_path(meta['uploadId']) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, _meta_path(meta['uploadId']))
+
+def create_session(kind, name, size, sha256=None, max_size=None):
+    """创建上传会话"""
+    if kind not in storage.STORAGE_KINDS:
+        raise UploadError('Invalid kind')
+    if not storage.is_valid_name(name):
+        raise UploadError('Invalid filename')
+    if not isinstance(size, int) or size < 0:
+        raise UploadError('Invalid size')
+    if max_size is not None and size > max_size:
+        raise UploadError('File too large', status=413)
+
+    os.makedirs(SESSION_DIR, exist_ok=True)
+    meta = {
+        'uploadId': uuid.uuid4().hex,
+        'kind': kind,
+        'filename': name,
+        'size': size,
+        'sha256': sha256.lower() if sha256 else None,
+        'offset': 0,
+        'createdAt': time.time()
+    }
+    open(_part_path(meta['uploadId']), 'wb').close()
+    _save_meta(meta)
+    return meta
+
+def load_session(upload_id):
+    """读取上传会话，不存在返回None"""
+    if not _UPLOAD_ID_RE.match(upload_id or ''):
+        return None
+    try:
+        with open(_meta_path(upload_id), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+@contextmanager
+def _session_lock(upload_id):
+    """会话级互斥：对 .part 文件加 flock，多个工作进程同时写同一会话时串行执行偏移检查与写入"""
+    if not _UPLOAD_ID_RE.match(upload_id or ''):
+        raise UploadError('Upload not found', status=404)
+    if fcntl is None:
+        with _thread_locks[upload_id]:
+            yield
+        return
+    try:
+        lock_file = open(_part_path(upload_id), 'rb')
+    except FileNotFoundError:
+        raise UploadError('Upload not found', status=404)
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        yield
+    finally:
+        lock_file.close()
+
+def _hasher_at(upload_id, offset):
+    """取得哈希到 offset 处的增量哈希对象；其他进程写入过或进程重启后从磁盘重新计算"""
+    state = _hashers.get(upload_id)
+    if state and state[0] == offset:
+        # 返回副本，写入中途失败时不会污染已缓存的状态
+        return state[1].copy()
+    digest = hashlib.sha256()
+    remaining = offset
+    with open(_part_path(upload_id), 'rb') as f:
+        while remaining:
+            chunk = f.read(min(storage.CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+def append_chunk(upload_id, offset, stream):
+    """在已确认偏移处追加分块，边写盘边更新哈希，返回新的偏移"""
+    with _session_lock(upload_id):
+        meta = load_session(upload_id)
+        if not meta:
+            raise UploadError('Upload not found', status=404)
+        if offset != meta['offset']:
+            raise UploadError('Offset mismatch', status=409, offset=meta['offset'])
+
+        digest = _hasher_at(upload_id, offset)
+        written = 0
+        with open(_part_path(upload_id), 'r+b') as f:
+            # 丢弃上次中断时未确认的尾部数据
+            f.truncate(offset)
+            f.seek(offset)
+            while True:
+                chunk = stream.read(storage.CHUNK_SIZE)
+                if not chunk:
+                    break
+                if offset + written + len(chunk) > meta['size']:
+                    f.truncate(offset)
+                    raise UploadError('Chunk exceeds declared size', status=413, offset=offset)
+                f.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+        meta['offset'] = offset + written
+        _save_meta(meta)
+        _hashers[upload_id] = (meta['offset'], digest)
+        return meta['offset']
+
+def finalize(upload_id):
+    """校验大小与哈希后将文件移入内容存储，返回 (StoredFile, 是否去重, 被替换的旧哈希)"""
+    with _session_lock(upload_id):
+        meta = load_session(upload_id)
+        if not meta:
+            raise UploadError('Upload not found', status=404)
+        if meta['offset'] != meta['size']:
+            raise UploadError('Upload incomplete', status=409, offset=meta['offset'])
+
+        sha256 = _hasher_at(upload_id, meta['offset']).hexdigest()
+        if meta['sha256'] and meta['sha256'] != sha256:
+            _discard(upload_id)
+            raise UploadError('Checksum mismatch', status=422)
+
+        os.makedirs(storage.blob_dir(meta['kind']), exist_ok=True)
+        result = storage.store_file(meta['kind'], meta['filename'], _part_path(upload_id), sha256, meta['size'])
+        _discard(upload_id)
+        return result
+
+def _discard(upload_id):
+    for path in (_part_path(upload_id), _meta_path(upload_id)):
+        if os.path.exists(path):
+            os.remove(path)
+    _hashers.pop(upload_id, None)
+    _thread_locks.pop(upload_id, None)
+
+def abort(upload_id):
+    """取消上传并删除已接收的数据"""
+    try:
+        with _session_lock(upload_id):
+            if load_session(upload_id):
+                _discard(upload_id)
+                return True
+    except UploadError:
+        pass
+    return False
+
+def purge_stale_sessions(max_age_seconds):
+    """清理超过 max_age_seconds 未完成的上传会话，返回清理数量"""
+    if not os.path.isdir(SESSION_DIR):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    purged = 0
+    for filename in os.listdir(SESSION_DIR):
+        upload_id, ext = os.path.splitext(filename)
+        if ext == '.json' and os.path.getmtime(os.path.join(SESSION_DIR, filename)) < cutoff:
+            _discard(upload_id)
+            purged += 1
+    return purged